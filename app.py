@@ -5,17 +5,36 @@ Integrated with features from anthrohpk-app
 Author: Habib Arsy and TIM
 """
 
+import io
 import os
+import csv
 import json
+import math
+import time
 import random
+import logging
+import threading
+from collections import deque, OrderedDict
 from datetime import datetime, timedelta
-from functools import wraps
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file
+from functools import wraps, lru_cache
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file, stream_with_context
 from werkzeug.utils import secure_filename
-import pandas as pd
+import xlsxwriter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 import plotly.graph_objs as go
 import plotly.utils
 from config import Config
+from models import db, init_db, create_tables, save_measurements, find_measurements, parse_date
+import pygrowup
+from pygrowup.tablestore import SD_CURVES, digest as tables_digest
+try:
+    import redis
+except ImportError:
+    # hanya diperlukan untuk CACHE_TYPE = 'redis'
+    redis = None
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -29,30 +48,216 @@ if not app.config.get('SECRET_KEY'):
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['SESSION_FILE_DIR'] = './flask_session'
 
+# Database pengukuran (lihat models.py)
+init_db(app)
+
 # Global variables for demo data
-demo_children = []
 growth_velocity_data = []
 kpsp_results = []
 
+# Kode jenis kelamin aplikasi (L/P) ke kode pygrowup (M/F)
+GENDERS = {'L': 'M', 'P': 'F'}
+
+# Indeks aplikasi dan indikator pygrowup; whz memakai wfl di bawah 24 bulan
+# dan wfh mulai 24 bulan
+INDICES = [('waz', ['wfa']), ('haz', ['lhfa']), ('whz', ['wfl', 'wfh']),
+           ('baz', ['bmifa']), ('hcz', ['hcfa'])]
+
+
+class LatencyStats:
+    """Waktu proses terakhir (jendela terbatas) untuk p50/p99"""
+
+    def __init__(self, window=10000):
+        self._seconds = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._seconds.append(seconds)
+            self.total += 1
+
+    def summary(self):
+        with self._lock:
+            seconds = list(self._seconds)
+            total = self.total
+        if not seconds:
+            return {'calls': 0, 'total_calls': total}
+        us = sorted(value * 1e6 for value in seconds)
+        return {'calls': len(us),
+                'mean_us': round(sum(us) / len(us), 2),
+                'p50_us': round(self.percentile(us, 50), 2),
+                'p99_us': round(self.percentile(us, 99), 2),
+                'total_calls': total}
+
+    @staticmethod
+    def percentile(ordered, q):
+        """Persentil q dari daftar terurut, interpolasi linear seperti
+        numpy.percentile"""
+        position = (len(ordered) - 1) * q / 100.0
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+# Tabel pygrowup kurva grafik tiap indikator (disambung bila lebih dari satu)
+CHART_CURVES = {'wfa': ['wfa_%s_0_5'], 'lhfa': ['lhfa_%s_0_5'],
+                'wfl': ['wfl_%s_0_2'], 'wfh': ['wfh_%s_2_5'],
+                'bmifa': ['bmifa_%s_0_2', 'bmifa_%s_2_5'],
+                'hcfa': ['hcfa_%s_0_5']}
+
+# Sidik isi tabel rujukan WHO pygrowup: berubah setiap kali nilai tabel
+# berubah, juga tanpa kenaikan versi pygrowup
+TABLES_DIGEST = tables_digest()
+
+# Bagian URL kurva rujukan; berubah bila tabel pygrowup berubah
+CURVES_VERSION = TABLES_DIGEST[:16]
+
+# Statistik latensi per worker, dilaporkan oleh /api/metrics
+latency = {'calculate_all': LatencyStats(),
+           'calculate_batch': LatencyStats()}
+
+# Jumlah angka desimal input yang dihitung (resolusi alat ukur): berat 10 g,
+# panjang/tinggi dan lingkar kepala 1 mm, usia 0,01 bulan (< 1 hari)
+RESOLUTION = {'weight': 2, 'height': 1, 'head_circumference': 1,
+              'age_months': 2}
+
+
+class ResultCache:
+    """Cache LRU hasil perhitungan per worker, dengan backend bersama
+    (redis) opsional di belakangnya"""
+
+    def __init__(self, max_entries=10000, timeout=300, shared=None,
+                 prefix='anthrogizi'):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.shared = shared
+        # kunci berubah bila kode atau isi tabel rujukan berubah
+        self.prefix = '%s:%s:%s:' % (prefix, pygrowup.__version__,
+                                     TABLES_DIGEST[:16])
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {'hits': 0, 'shared_hits': 0, 'misses': 0,
+                       'shared_errors': 0}
+
+    def key(self, name, inputs):
+        return self.prefix + name + ':' + json.dumps(inputs, sort_keys=True)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def get(self, key):
+        """Nilai tersimpan dan sumbernya ('hit' atau 'shared'), atau
+        (None, 'miss')"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return entry[1], 'hit'
+        if self.shared is not None:
+            try:
+                stored = self.shared.get(key)
+            except Exception as e:
+                logging.getLogger(__name__).warning('cache: %s', e)
+                self._count('shared_errors')
+                stored = None
+            if stored is not None:
+                value = json.loads(stored)
+                self._store(key, value)
+                self._count('shared_hits')
+                return value, 'shared'
+        self._count('misses')
+        return None, 'miss'
+
+    def _store(self, key, value):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.setex(key, self.timeout, json.dumps(value))
+            except Exception as e:
+                logging.getLogger(__name__).warning('cache: %s', e)
+                self._count('shared_errors')
+
+    def cached(self, name, inputs, compute):
+        """Hasil compute() untuk inputs, dari cache bila ada"""
+        key = self.key(name, inputs)
+        value, source = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value, source
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counts, entries=len(self._entries),
+                         max_entries=self.max_entries,
+                         shared=self.shared is not None)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = round(
+            (stats['hits'] + stats['shared_hits']) / lookups, 4) if lookups else None
+        return stats
+
+
+def make_result_cache(config):
+    """ResultCache sesuai CACHE_TYPE: 'null' tanpa cache, 'simple' LRU per
+    worker, 'redis' LRU per worker plus redis di CACHE_REDIS_URL"""
+    cache_type = config.get('CACHE_TYPE', 'simple')
+    max_entries = config.get('CACHE_MAX_ENTRIES', 10000)
+    shared = None
+    if cache_type == 'null':
+        max_entries = 0
+    elif cache_type == 'redis':
+        if redis is None:
+            logging.getLogger(__name__).warning(
+                'cache: paket redis tidak terpasang, memakai cache lokal')
+        else:
+            shared = redis.Redis.from_url(config['CACHE_REDIS_URL'],
+                                          socket_timeout=0.05)
+    return ResultCache(max_entries, config.get('CACHE_DEFAULT_TIMEOUT', 300),
+                       shared)
+
+
+result_cache = make_result_cache(app.config)
+
 class ChildNutritionCalculator:
     """Enhanced WHO calculator with all measurement types"""
-    
-    @staticmethod
-    def calculate_all_indices(weight, height, age_months, gender, head_circumference=None):
+
+    # Satu Calculator per proses worker: tabel WHO dimuat sekali saat
+    # import, bukan pada setiap request
+    growth = pygrowup.Calculator(precision='float')
+
+    @classmethod
+    def calculate_all_indices(cls, weight, height, age_months, gender, head_circumference=None):
         """Calculate all WHO indices"""
+        if gender not in GENDERS:
+            raise ValueError('Jenis kelamin harus L atau P')
+        zscores = cls.growth.all_indicators(weight, height, age_months,
+                                            GENDERS[gender],
+                                            head_circumference)
         results = {}
-        
-        # Mock calculations for demo - in production, use pygrowup
-        results['waz'] = round(random.uniform(-2.5, 2.5), 2)  # Weight-for-Age
-        results['haz'] = round(random.uniform(-2.5, 2.5), 2)  # Height-for-Age
-        results['whz'] = round(random.uniform(-2.5, 2.5), 2)  # Weight-for-Height
-        results['baz'] = round(random.uniform(-2.5, 2.5), 2)  # BMI-for-Age
-        
-        if head_circumference:
-            results['hcz'] = round(random.uniform(-2.5, 2.5), 2)  # Head Circumference-for-Age
+        for index, indicators in INDICES:
+            for indicator in indicators:
+                if zscores[indicator] is not None:
+                    results[index] = round(float(zscores[indicator]), 2)
         
         # Add interpretations
-        for index, value in results.items():
+        for index, value in list(results.items()):
             if value < -3:
                 results[f'{index}_status'] = 'Gizi Buruk'
                 results[f'{index}_color'] = 'danger'
@@ -164,40 +369,66 @@ def about_page():
     """About and support page"""
     return render_template('about.html')
 
+def child_inputs(data):
+    """Input satu anak, dibulatkan ke resolusi alat ukur (RESOLUTION)"""
+    inputs = {'gender': data.get('gender', 'L'), 'head_circumference': None}
+    for name, digits in RESOLUTION.items():
+        value = data.get(name, 0)
+        if name == 'head_circumference' and not value:
+            continue
+        inputs[name] = round(float(value), digits)
+    return inputs
+
+def calculate_child(data, stats):
+    """Hitung semua indeks untuk satu anak (dict input calculate-all),
+    mencatat waktu perhitungan di stats"""
+    inputs = child_inputs(data)
+    weight, height, age_months, gender, head_circumference = [
+        inputs[name] for name in ['weight', 'height', 'age_months', 'gender',
+                                  'head_circumference']]
+    
+    # Calculate all indices
+    started = time.perf_counter()
+    results = calculator.calculate_all_indices(weight, height, age_months, gender, head_circumference)
+    elapsed = time.perf_counter() - started
+    stats.record(elapsed)
+    
+    # Add additional info
+    results['age_months'] = age_months
+    results['weight'] = weight
+    results['height'] = height
+    results['gender'] = gender
+    results['head_circumference'] = head_circumference
+    return results, elapsed
+
 @app.route('/api/calculate-all', methods=['POST'])
 def calculate_all():
     """Calculate all WHO indices"""
     try:
         data = request.json
+        timing = {}
+
+        def compute():
+            results, timing['elapsed'] = calculate_child(data, latency['calculate_all'])
+            
+            # Generate chart data
+            chart_data = generate_growth_chart(results['weight'], results['height'], results['age_months'], results['gender'])
+            results['chart_data'] = chart_data
+            return results
+
+        results, source = result_cache.cached(
+            'calculate-all', child_inputs(data), compute)
         
-        # Extract data
-        weight = float(data.get('weight', 0))
-        height = float(data.get('height', 0))
-        age_months = int(data.get('age_months', 0))
-        gender = data.get('gender', 'L')
-        head_circumference = data.get('head_circumference')
-        if head_circumference:
-            head_circumference = float(head_circumference)
-        
-        # Calculate all indices
-        results = calculator.calculate_all_indices(weight, height, age_months, gender, head_circumference)
-        
-        # Add additional info
-        results['age_months'] = age_months
-        results['weight'] = weight
-        results['height'] = height
-        results['gender'] = gender
-        results['head_circumference'] = head_circumference
-        
-        # Generate chart data
-        chart_data = generate_growth_chart(weight, height, age_months, gender)
-        results['chart_data'] = chart_data
-        
-        return jsonify({
+        response = jsonify({
             'success': True,
             'results': results,
             'message': 'Perhitungan berhasil dilakukan'
         })
+        if 'elapsed' in timing:
+            response.headers['Server-Timing'] = 'calc;dur=%.3f' % (timing['elapsed'] * 1000)
+        else:
+            response.headers['Server-Timing'] = 'cache;desc=%s' % source
+        return response
     
     except Exception as e:
         return jsonify({
@@ -206,6 +437,54 @@ def calculate_all():
             'message': 'Terjadi kesalahan dalam perhitungan'
         })
 
+def read_batch_rows():
+    """Baris anak dari request batch: array JSON (atau {'children': [...]}),
+    file CSV di field 'file', atau body text/csv"""
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+    elif request.mimetype == 'text/csv':
+        text = request.get_data(as_text=True)
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('children')
+        if not isinstance(data, list):
+            raise ValueError('Kirim array JSON atau file CSV')
+        return data
+    return list(csv.DictReader(io.StringIO(text)))
+
+@app.route('/api/calculate-batch', methods=['POST'])
+def calculate_batch():
+    """Calculate all WHO indices for a whole session of children, streamed
+    as NDJSON: one line per child, in input order"""
+    try:
+        rows = read_batch_rows()
+    except (ValueError, csv.Error) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Data batch tidak valid'
+        }), 400
+
+    def generate():
+        for number, data in enumerate(rows, 1):
+            line = {'row': number}
+            try:
+                if not isinstance(data, dict):
+                    raise ValueError('Baris harus berupa objek')
+                if data.get('id') is not None:
+                    line['id'] = data['id']
+                line['results'], elapsed = calculate_child(data, latency['calculate_batch'])
+                line['success'] = True
+            except Exception as e:
+                line['success'] = False
+                line['error'] = str(e)
+            yield json.dumps(line) + '\n'
+
+    return app.response_class(stream_with_context(generate()),
+                              mimetype='application/x-ndjson')
+
 @app.route('/api/easy-mode', methods=['POST'])
 def easy_mode_calculation():
     """Easy mode calculation"""
@@ -213,26 +492,35 @@ def easy_mode_calculation():
         data = request.json
         age_months = int(data.get('age_months', 0))
         gender = data.get('gender', 'L')
-        
-        # Get normal ranges
-        ranges = calculator.get_normal_ranges(age_months, gender)
-        
-        # Calculate age in days
-        if data.get('birth_date') and data.get('measurement_date'):
-            age_days = calculator.calculate_age_in_days(
-                data['birth_date'], 
-                data['measurement_date']
-            )
-        else:
-            age_days = age_months * 30
-        
-        return jsonify({
-            'success': True,
-            'ranges': ranges,
-            'age_days': age_days,
-            'age_months': age_months,
-            'gender': gender
-        })
+        birth_date = data.get('birth_date') or None
+        measurement_date = data.get('measurement_date') or None
+
+        def compute():
+            # Get normal ranges
+            ranges = calculator.get_normal_ranges(age_months, gender)
+            
+            # Calculate age in days
+            if birth_date and measurement_date:
+                age_days = calculator.calculate_age_in_days(
+                    birth_date, 
+                    measurement_date
+                )
+            else:
+                age_days = age_months * 30
+            
+            return {
+                'success': True,
+                'ranges': ranges,
+                'age_days': age_days,
+                'age_months': age_months,
+                'gender': gender
+            }
+
+        result, source = result_cache.cached('easy-mode', {
+            'age_months': age_months, 'gender': gender,
+            'birth_date': birth_date,
+            'measurement_date': measurement_date}, compute)
+        return jsonify(result)
     
     except Exception as e:
         return jsonify({
@@ -341,28 +629,16 @@ def calculate_growth_velocity():
         })
 
 def generate_growth_chart(weight, height, age_months, gender):
-    """Generate growth chart data"""
-    # Mock WHO reference data
-    ages = list(range(0, 61, 3))
-    
-    if gender == 'L':
-        who_weight_p50 = [3.3, 5.6, 7.0, 8.2, 9.2, 10.1, 10.9, 11.5, 12.0, 12.5, 12.9, 13.3, 13.6, 13.9, 14.2, 14.5, 14.7, 14.9, 15.1, 15.3, 15.5]
-        who_height_p50 = [50, 58, 63, 67, 71, 74, 77, 79, 81, 83, 85, 87, 89, 90, 92, 93, 94, 95, 96, 97, 98]
-    else:
-        who_weight_p50 = [3.2, 5.1, 6.4, 7.5, 8.4, 9.2, 9.9, 10.5, 11.0, 11.5, 11.9, 12.3, 12.7, 13.0, 13.3, 13.6, 13.9, 14.1, 14.3, 14.5, 14.7]
-        who_height_p50 = [49, 57, 61, 65, 69, 72, 75, 77, 79, 81, 83, 85, 87, 88, 90, 91, 92, 93, 94, 95, 96]
-    
-    # Create chart data
+    """Generate growth chart data: only the child's points, with the URL of
+    the WHO reference curves (see reference_curves_api)"""
     chart_data = {
         'weight_chart': {
-            'ages': ages,
-            'who_reference': who_weight_p50,
+            'curves_url': url_for('reference_curves_api', version=CURVES_VERSION, indicator='wfa', gender=gender),
             'child_data': [{'x': age_months, 'y': weight}],
             'title': 'Grafik Berat Badan Menurut Usia'
         },
         'height_chart': {
-            'ages': ages,
-            'who_reference': who_height_p50,
+            'curves_url': url_for('reference_curves_api', version=CURVES_VERSION, indicator='lhfa', gender=gender),
             'child_data': [{'x': age_months, 'y': height}],
             'title': 'Grafik Tinggi Badan Menurut Usia'
         }
@@ -370,64 +646,254 @@ def generate_growth_chart(weight, height, age_months, gender):
     
     return chart_data
 
+@lru_cache(maxsize=None)
+def reference_curves(indicator, gender):
+    """JSON kurva rujukan WHO -3..+3 SD dan ETag-nya, dihitung dari tabel
+    L/M/S pygrowup sekali per (indikator, jenis kelamin) per worker"""
+    sex = {'L': 'boys', 'P': 'girls'}[gender]
+    keys = []
+    curves = dict((sd, []) for sd in SD_CURVES)
+    for table_name in CHART_CURVES[indicator]:
+        table = calculator.growth.tables[table_name % sex]
+        table_keys = table.keys()
+        # baris tabel berikutnya dipakai untuk usia yang tumpang tindih
+        # (mis. 24 bulan pada bmifa 0-2 dan 2-5)
+        keep = len([key for key in keys if key < table_keys[0]])
+        del keys[keep:]
+        keys.extend(table_keys)
+        for sd, values in table.curves(SD_CURVES).items():
+            del curves[sd][keep:]
+            curves[sd].extend(values)
+    body = json.dumps({
+        'indicator': indicator,
+        'gender': gender,
+        'version': CURVES_VERSION,
+        'x': table.field_name,
+        'keys': keys,
+        'curves': dict((str(sd), [None if math.isnan(v) else round(v, 3)
+                                  for v in values])
+                       for sd, values in curves.items())
+    }, separators=(',', ':'))
+    return body, '%s-%s-%s' % (TABLES_DIGEST, indicator, gender)
+
+@app.route('/api/reference-curves/<version>/<indicator>/<gender>')
+def reference_curves_api(version, indicator, gender):
+    """WHO reference curves for growth charts; the URL changes with the
+    tables, so responses may be cached forever"""
+    if version != CURVES_VERSION or indicator not in CHART_CURVES or gender not in GENDERS:
+        return jsonify({
+            'success': False,
+            'message': 'Kurva rujukan tidak ditemukan'
+        }), 404
+    body, etag = reference_curves(indicator, gender)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+# Jenis file tiap format export
+EXPORT_MIMETYPES = {
+    'csv': ('text/csv', 'csv'),
+    'excel': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'pdf': ('application/pdf', 'pdf')
+}
+
+def export_columns(rows):
+    """Nama kolom semua baris, sesuai urutan kemunculan"""
+    columns = {}
+    for row in rows:
+        for name in row:
+            columns.setdefault(name, None)
+    return list(columns)
+
+def export_cell(value):
+    """Nilai sel export: dict/list sebagai JSON, None sebagai kosong"""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+# Awal teks yang dibaca sebagai rumus oleh Excel/LibreOffice
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_cell(value):
+    """Sel CSV; teks yang akan dibaca sebagai rumus diawali ' agar tetap
+    teks (CSV injection)"""
+    value = export_cell(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def export_csv(rows, columns):
+    """Baris CSV satu per satu, tanpa menyimpan seluruh file"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([csv_cell(name) for name in columns])
+    for row in rows:
+        writer.writerow([csv_cell(row.get(name)) for name in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_xlsx(rows, columns):
+    """File XLSX di memori; baris ditulis dalam mode constant_memory"""
+    output = io.BytesIO()
+    # teks ditulis apa adanya, tidak diubah menjadi rumus atau tautan
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True,
+                                            'strings_to_formulas': False,
+                                            'strings_to_urls': False})
+    worksheet = workbook.add_worksheet('Data')
+    header = workbook.add_format({'bold': True})
+    worksheet.write_row(0, 0, columns, header)
+    for number, row in enumerate(rows, 1):
+        worksheet.write_row(number, 0, [export_cell(row.get(name)) for name in columns])
+    workbook.close()
+    output.seek(0)
+    return output
+
+def export_pdf(rows, columns):
+    """File PDF di memori berisi tabel data"""
+    output = io.BytesIO()
+    document = SimpleDocTemplate(output, pagesize=landscape(A4),
+                                 title='Export anthroGizi')
+    styles = getSampleStyleSheet()
+    table = Table([columns] + [[str(export_cell(row.get(name))) for name in columns] for row in rows],
+                  repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FFB6C1')),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP')
+    ]))
+    document.build([
+        Paragraph('Export anthroGizi', styles['Title']),
+        Paragraph(datetime.now().strftime('%Y-%m-%d %H:%M'), styles['Normal']),
+        Spacer(1, 12),
+        table
+    ])
+    output.seek(0)
+    return output
+
 @app.route('/api/export-data', methods=['POST'])
 def export_data():
-    """Export data to various formats"""
-    try:
-        data = request.json
-        format_type = data.get('format', 'pdf')
-        
-        # Create DataFrame from data
-        df = pd.DataFrame(data.get('data', []))
-        
-        if format_type == 'excel':
-            output = 'export.xlsx'
-            df.to_excel(output, index=False)
-        elif format_type == 'csv':
-            output = 'export.csv'
-            df.to_csv(output, index=False)
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Format tidak didukung'
-            })
-        
-        return jsonify({
-            'success': True,
-            'message': f'Data berhasil diexport sebagai {format_type}',
-            'filename': output
-        })
+    """Export data to various formats, returned as a download"""
+    data = request.get_json(silent=True) or {}
+    format_type = data.get('format', 'pdf')
+    rows = data.get('data', [])
     
-    except Exception as e:
+    if format_type not in app.config['EXPORT_FORMATS']:
         return jsonify({
             'success': False,
-            'error': str(e)
-        })
+            'message': 'Format tidak didukung'
+        }), 400
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return jsonify({
+            'success': False,
+            'message': 'Data export harus berupa daftar objek'
+        }), 400
+    if len(rows) > app.config['EXPORT_MAX_RECORDS']:
+        return jsonify({
+            'success': False,
+            'message': 'Maksimal %d data per export' % app.config['EXPORT_MAX_RECORDS']
+        }), 400
+    
+    columns = export_columns(rows)
+    mimetype, extension = EXPORT_MIMETYPES[format_type]
+    filename = 'anthrogizi-export-%s.%s' % (datetime.now().strftime('%Y%m%d-%H%M%S'), extension)
+    
+    if format_type == 'csv':
+        response = app.response_class(stream_with_context(export_csv(rows, columns)),
+                                      mimetype=mimetype)
+        response.headers['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+    
+    if format_type == 'excel':
+        output = export_xlsx(rows, columns)
+    else:
+        output = export_pdf(rows, columns)
+    return send_file(output, mimetype=mimetype, as_attachment=True,
+                     download_name=filename)
 
 @app.route('/api/save-calculation', methods=['POST'])
 def save_calculation():
-    """Save calculation results"""
-    try:
-        data = request.json
-        
-        # Add timestamp
-        data['timestamp'] = datetime.now().isoformat()
-        data['id'] = len(demo_children) + 1
-        
-        # Save to demo storage
-        demo_children.append(data)
-        
+    """Save calculation results: one object, or a list of them (batch)"""
+    data = request.get_json(silent=True)
+    rows = data if isinstance(data, list) else [data]
+    if len(rows) > app.config['EXPORT_MAX_RECORDS']:
         return jsonify({
-            'success': True,
-            'message': 'Data berhasil disimpan',
-            'id': data['id']
-        })
+            'success': False,
+            'message': 'Maksimal %d data per penyimpanan' % app.config['EXPORT_MAX_RECORDS']
+        }), 400
     
+    try:
+        ids = save_measurements(rows)
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Data tidak valid'
+        }), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({
             'success': False,
             'error': str(e)
         })
+    
+    if isinstance(data, list):
+        return jsonify({
+            'success': True,
+            'message': '%d data berhasil disimpan' % len(ids),
+            'ids': ids
+        })
+    return jsonify({
+        'success': True,
+        'message': 'Data berhasil disimpan',
+        'id': ids[0]
+    })
+
+@app.route('/api/measurements')
+def list_measurements():
+    """Saved measurements by child_id and/or date range (date_from,
+    date_to), paged with after_id"""
+    try:
+        # ukuran halaman 1..EXPORT_MAX_RECORDS; next_after_id dibandingkan
+        # dengan nilai yang sudah dibatasi ini
+        limit = max(min(int(request.args.get('limit', 100)), app.config['EXPORT_MAX_RECORDS']), 1)
+        after_id = request.args.get('after_id', type=int)
+        measurements = find_measurements(
+            child_id=request.args.get('child_id') or None,
+            date_from=parse_date(request.args.get('date_from')),
+            date_to=parse_date(request.args.get('date_to')),
+            after_id=after_id,
+            limit=limit)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Parameter tidak valid'
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'measurements': [m.to_dict() for m in measurements],
+        'next_after_id': measurements[-1].id if len(measurements) == limit else None
+    })
+
+@app.route('/api/metrics')
+def metrics():
+    """Latency of calculations in this worker, in microseconds"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'latency': dict((name, stats.summary())
+                        for name, stats in latency.items()),
+        'cache': result_cache.stats()
+    })
 
 @app.route('/api/theme', methods=['POST'])
 def set_theme():
@@ -480,11 +946,20 @@ def inject_globals():
         'motivational_message': '' # Tambahkan ini juga agar aman
     }
 
+@app.cli.command('init-db')
+def init_db_command():
+    """Buat tabel database (sekali per deploy, sebelum server dimulai)"""
+    create_tables(app)
+    print('Tabel database siap')
+
 if __name__ == '__main__':
     # Create necessary directories
     os.makedirs('flask_session', exist_ok=True)
     os.makedirs('uploads', exist_ok=True)
     os.makedirs('data', exist_ok=True)
+
+    # Server pengembangan: satu proses, tabel dibuat di sini
+    create_tables(app)
     
     # Run the application
     app.run(
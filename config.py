@@ -6,7 +6,17 @@ class Config:
     
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///anthrogizi.db'
+    if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+        # URL gaya Heroku; SQLAlchemy hanya mengenal postgresql://
+        SQLALCHEMY_DATABASE_URI = 'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Koneksi dipakai ulang per worker; pre_ping membuang koneksi yang
+    # sudah diputus server database
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 1800}
+    if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        SQLALCHEMY_ENGINE_OPTIONS.update(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)))
     
     # Session configuration
     SESSION_TYPE = 'filesystem'
@@ -111,6 +121,7 @@ class Config:
     # Cache configuration
     CACHE_TYPE = 'simple'
     CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_MAX_ENTRIES = 10000  # hasil per worker (LRU)
     
     # Development configuration
     DEBUG = os.environ.get('FLASK_DEBUG') or True
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Penyimpanan hasil pengukuran anak (SQLAlchemy), menggantikan daftar
+demo_children di memori
+"""
+
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, insert
+
+db = SQLAlchemy()
+
+
+class Measurement(db.Model):
+    """Satu pengukuran seorang anak, dengan data form aslinya"""
+
+    __tablename__ = 'measurements'
+    __table_args__ = (
+        # riwayat seorang anak menurut tanggal
+        db.Index('ix_measurements_child_date', 'child_id', 'measurement_date'),
+        # laporan per periode
+        db.Index('ix_measurements_date', 'measurement_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    child_id = db.Column(db.String(64))
+    child_name = db.Column(db.String(200))
+    mother_name = db.Column(db.String(200))
+    gender = db.Column(db.String(1))
+    birth_date = db.Column(db.Date)
+    measurement_date = db.Column(db.Date, nullable=False)
+    age_months = db.Column(db.Float)
+    weight = db.Column(db.Float)
+    height = db.Column(db.Float)
+    head_circumference = db.Column(db.Float)
+    measurement_type = db.Column(db.String(32))
+    data = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'child_id': self.child_id,
+            'child_name': self.child_name,
+            'mother_name': self.mother_name,
+            'gender': self.gender,
+            'birth_date': self.birth_date.isoformat() if self.birth_date else None,
+            'measurement_date': self.measurement_date.isoformat(),
+            'age_months': self.age_months,
+            'weight': self.weight,
+            'height': self.height,
+            'head_circumference': self.head_circumference,
+            'measurement_type': self.measurement_type,
+            'data': self.data,
+            'timestamp': self.created_at.isoformat()
+        }
+
+
+def parse_date(value):
+    """Tanggal ISO (YYYY-MM-DD) atau None bila kosong"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def measurement_row(data, now=None):
+    """Kolom Measurement dari data form calculate-all/save-calculation.
+    Tanggal pengukuran kosong dianggap hari ini (tanggal disimpan)."""
+    if not isinstance(data, dict):
+        raise ValueError('Data harus berupa objek')
+    now = now or datetime.now()
+
+    def number(name):
+        value = data.get(name)
+        return None if value in (None, '') else float(value)
+
+    def text(name, length):
+        value = data.get(name)
+        return None if value in (None, '') else str(value)[:length]
+
+    return {
+        'child_id': text('child_id', 64),
+        'child_name': text('child_name', 200),
+        'mother_name': text('mother_name', 200),
+        'gender': text('gender', 1),
+        'birth_date': parse_date(data.get('birth_date')),
+        'measurement_date': parse_date(data.get('measurement_date')) or now.date(),
+        'age_months': number('age_months'),
+        'weight': number('weight'),
+        'height': number('height'),
+        'head_circumference': number('head_circumference'),
+        'measurement_type': text('measurement_type', 32),
+        'data': data,
+        'created_at': now
+    }
+
+
+def save_measurements(rows):
+    """Simpan banyak pengukuran dalam satu transaksi (INSERT executemany)
+    dan kembalikan id-nya sesuai urutan"""
+    now = datetime.now()
+    values = [measurement_row(data, now) for data in rows]
+    if not values:
+        return []
+    ids = db.session.scalars(
+        insert(Measurement).returning(Measurement.id,
+                                      sort_by_parameter_order=True),
+        values).all()
+    db.session.commit()
+    return ids
+
+
+def find_measurements(child_id=None, date_from=None, date_to=None,
+                      after_id=None, limit=100):
+    """Pengukuran menurut anak dan/atau periode, urut id; halaman
+    berikutnya dimulai setelah after_id (bukan offset, agar tetap cepat
+    pada tabel besar)"""
+    query = db.select(Measurement).order_by(Measurement.id).limit(limit)
+    if child_id is not None:
+        query = query.where(Measurement.child_id == child_id)
+    if date_from is not None:
+        query = query.where(Measurement.measurement_date >= date_from)
+    if date_to is not None:
+        query = query.where(Measurement.measurement_date <= date_to)
+    if after_id is not None:
+        query = query.where(Measurement.id > after_id)
+    return db.session.scalars(query).all()
+
+
+def _sqlite_pragmas(connection, record):
+    # WAL: worker lain tetap bisa membaca saat satu worker menulis
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def init_db(app):
+    """Hubungkan db ke app. Tabel tidak dibuat di sini karena setiap worker
+    gunicorn mengimpor app; lihat create_tables."""
+    db.init_app(app)
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            event.listen(engine, 'connect', _sqlite_pragmas)
+
+
+def create_tables(app):
+    """Buat tabel yang belum ada; dijalankan sekali per deploy
+    (`flask --app app init-db`), sebelum worker dimulai"""
+    with app.app_context():
+        db.create_all()
@@ -1,4 +1,5 @@
 from .pygrowup import Calculator
+from .tablestore import preload
 
 __version_info__ = {
     'major': 0,
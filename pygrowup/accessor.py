@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" pandas accessor for growth z-scores.
+
+    Importing this module registers a `growup` accessor on DataFrames,
+    which scores whole columns with the vectorized engine:
+
+        import pygrowup.accessor
+
+        df = df.join(df.growup.zscores(['wfa', 'lhfa']))
+        df = df.join(df.growup.survey())    # WHO Anthro _Z*/_F* columns
+
+    Column names default to those of WHO Anthro survey exports (WEIGHT,
+    HEIGHT, agemons, GENDER, HEAD), and GENDER may be coded 1/2 or M/F.
+"""
+import pandas as pd
+
+from . import batch
+from . import pygrowup
+
+
+# columns needed by each indicator, besides age and sex
+MEASUREMENTS = {'wfa': ['weight'], 'lhfa': ['height'],
+                'wfl': ['weight', 'height'], 'wfh': ['weight', 'height'],
+                'bmifa': ['weight', 'height'], 'hcfa': ['head_circumference']}
+
+
+@pd.api.extensions.register_dataframe_accessor('growup')
+class GrowupAccessor(object):
+    def __init__(self, df):
+        self._df = df
+
+    def zscores(self, indicators=None, calculator=None, weight='WEIGHT',
+                height='HEIGHT', age='agemons', sex='GENDER',
+                head_circumference='HEAD', flags=False):
+        """ DataFrame of z-scores with one column per indicator (by default
+        all of them) and the index of this frame.
+
+        As with Calculator.all_indicators, wfl is calculated under 24
+        months and wfh from 24 months, and BMI is calculated from weight
+        and height. Scores that do not apply or cannot be calculated
+        are NaN. With flags, each indicator also gets a nullable integer
+        column flagging implausible z-scores (e.g., wfa_flag). """
+        if indicators is None:
+            indicators = pygrowup.INDICATORS
+        if calculator is None:
+            calculator = pygrowup.Calculator()
+        names = {'weight': weight, 'height': height,
+                 'head_circumference': head_circumference}
+        needed = set(m for i in indicators for m in MEASUREMENTS[i])
+        columns = dict((m, self._df[names[m]].to_numpy() if m in needed
+                        else None) for m in names)
+        results = calculator.all_indicators_batch(
+            columns['weight'], columns['height'], self._df[age].to_numpy(),
+            batch.survey_sexes(self._df[sex].to_numpy()),
+            columns['head_circumference'], indicators, flags)
+        scored = pd.DataFrame(results, index=self._df.index,
+                              columns=list(results))
+        if flags:
+            for indicator in indicators:
+                name = indicator + '_flag'
+                scored[name] = scored[name].astype('Int8')
+        return scored
+
+    def survey(self, calculator=None):
+        """ DataFrame of the WHO Anthro columns added by python -m
+        pygrowup.batch (_CLENHEI, _CBMI, _ZWEI, ..., _FBMI), using the
+        measure and oedema columns if present. Flags are nullable
+        integers. """
+        if calculator is None:
+            calculator = pygrowup.Calculator()
+        columns = dict((name, self._df[name].to_numpy())
+                       for name in batch.REQUIRED_COLUMNS +
+                       ['measure', 'oedema'] if name in self._df)
+        results = batch.score_columns(calculator, columns)
+        scored = pd.DataFrame(
+            dict((name, results[name]) for name in batch.OUTPUT_COLUMNS),
+            index=self._df.index)
+        for name in batch.FLAG_COLUMNS:
+            scored[name] = scored[name].astype('Int8')
+        return scored
@@ -0,0 +1,663 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Prevalence of stunting, wasting, and underweight by group.
+
+    Prevalence accumulates, for each group (e.g., region, age band, and
+    sex) and z-score column, the number of z-scores, their mean and sum
+    of squared deviations (for the SD), and the number below -2 and -3,
+    in a single pass. Chunks can be added one at a time, and partial
+    results from other chunks or processes merged in, so a survey of any
+    size is aggregated without keeping its z-scores.
+
+    survey_estimates weights the z-scores by the survey's sampling weights
+    (SW) and adds bootstrap confidence intervals, resampling clusters in
+    worker processes.
+
+    python -m pygrowup.aggregate survey.csv --by region --by sex
+    python -m pygrowup.aggregate survey.csv --by region --weight SW \
+        [--cluster cluster] [--strata region] [--replicates 1000] [--seed 1]
+
+    Both read and score the survey a chunk at a time (--chunk-size), in
+    worker processes with --jobs.
+"""
+import sys
+import csv
+import math
+import argparse
+import warnings
+from concurrent import futures
+
+import numpy as np
+
+from . import batch
+from . import pygrowup
+from . import vectorized
+
+
+# z-score columns of the batch engine, and what z < -2 means for each
+INDICATORS = {'_ZLEN': 'stunting', '_ZWFL': 'wasting',
+              '_ZWEI': 'underweight', '_ZBMI': 'thinness'}
+
+# flag column of each z-score column (see batch.FLAG_COLUMNS)
+FLAGS = dict(zip(batch.ZSCORE_COLUMNS, batch.FLAG_COLUMNS))
+
+# upper bounds (exclusive, in months) and labels of the age bands
+# reported by WHO Anthro
+AGE_BANDS = [(6, '0-5'), (12, '6-11'), (24, '12-23'), (36, '24-35'),
+             (48, '36-47'), (60, '48-59')]
+
+# bootstrap replicates drawn from each random stream
+REPLICATE_BLOCK = 50
+
+# largest number of cluster draws held in memory at a time, per process
+RESAMPLE_ELEMENTS = 1 << 22
+
+
+def age_bands(ages):
+    """ Label of the age band of each age in months, or '' if none """
+    ages = vectorized.as_float_array(ages)
+    bands = np.full(ages.shape, '', dtype='<U5')
+    lower = 0
+    for upper, label in AGE_BANDS:
+        bands[(ages >= lower) & (ages < upper)] = label
+        lower = upper
+    return bands
+
+
+def group_codes(columns):
+    """ One integer code per row for the combination of values of the
+    group columns, and the group (tuple of values) of each code """
+    if not columns:
+        return None, [()]
+    codes = None
+    values = []
+    for column in columns:
+        uniques = {}
+        column_codes = np.array(
+            [uniques.setdefault(value, len(uniques))
+             for value in np.asarray(column, dtype=object).tolist()],
+            dtype=np.int64)
+        codes = column_codes if codes is None else\
+            codes * len(uniques) + column_codes
+        values.append(list(uniques))
+    # number the combinations that occur, rather than all of them
+    occurring, codes = np.unique(codes, return_inverse=True)
+    groups = []
+    for code in occurring.tolist():
+        group = []
+        for uniques in reversed(values):
+            code, index = divmod(code, len(uniques))
+            group.append(uniques[index])
+        groups.append(tuple(reversed(group)))
+    return codes, groups
+
+
+def group_columns(columns, by):
+    """ Columns named in by, with 'age_band' and 'sex' derived from agemons
+    and GENDER if columns has no such columns """
+    selected = []
+    for name in by:
+        if name == 'age_band' and name not in columns:
+            selected.append(age_bands(columns['agemons']))
+        elif name == 'sex' and name not in columns:
+            selected.append(batch.survey_sexes(columns['GENDER']))
+        else:
+            selected.append(columns[name])
+    return selected
+
+
+def valid_zscores(columns, indicator, exclude_flagged=True):
+    """ Z-scores of the indicator column, as floats, and which of them to
+    count: those not missing and, if exclude_flagged, not flagged """
+    z = vectorized.as_float_array(columns[indicator])
+    valid = ~np.isnan(z)
+    flag = FLAGS.get(indicator)
+    if exclude_flagged and flag is not None and flag in columns:
+        valid &= vectorized.as_float_array(columns[flag]) != 1
+    return z, valid
+
+
+class Prevalence(object):
+    """ Prevalence of z < -2 and z < -3, and mean and SD of z, for each
+    group and z-score column, accumulated a chunk at a time.
+
+        prevalence = Prevalence(by=['region', 'sex'])
+        for chunk in chunks:
+            prevalence.add(chunk)  # dict of columns, or a DataFrame
+        prevalence.merge(other)     # e.g., from another process
+        prevalence.results()
+
+    Group columns 'age_band' and 'sex' are derived from agemons and GENDER
+    if the chunks have no such columns. Z-scores flagged as implausible
+    (_FWEI, etc.) are left out, as by WHO Anthro, unless exclude_flagged
+    is False. """
+
+    def __init__(self, by=(), indicators=None, exclude_flagged=True):
+        self.by = list(by)
+        self.indicators = list(indicators or INDICATORS)
+        self.exclude_flagged = exclude_flagged
+        # group => z-score column => [n, mean, m2, below -2, below -3]
+        self.groups = {}
+
+    def add(self, columns):
+        """ Add a chunk, given as a dict of columns (or a DataFrame) with
+        the z-score columns and the group columns """
+        codes, groups = group_codes(group_columns(columns, self.by))
+        for indicator in self.indicators:
+            z, valid = valid_zscores(columns, indicator,
+                                     self.exclude_flagged)
+            group = np.zeros(z.shape, dtype=np.intp) if codes is None\
+                else codes
+            group, z = group[valid], z[valid]
+            size = len(groups)
+            n = np.bincount(group, minlength=size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.bincount(group, weights=z, minlength=size) / n
+            m2 = np.bincount(group, weights=(z - mean[group]) ** 2,
+                             minlength=size)
+            below_2 = np.bincount(group, weights=z < -2, minlength=size)
+            below_3 = np.bincount(group, weights=z < -3, minlength=size)
+            for i, key in enumerate(groups):
+                if n[i]:
+                    self._merge_moments(key, indicator, [
+                        int(n[i]), float(mean[i]), float(m2[i]),
+                        int(below_2[i]), int(below_3[i])])
+        return self
+
+    def merge(self, other):
+        """ Add the partial results of another Prevalence (of the same
+        groups and columns), e.g., from another chunk or process """
+        for key, indicators in other.groups.items():
+            for indicator, moments in indicators.items():
+                self._merge_moments(key, indicator, moments)
+        return self
+
+    def _merge_moments(self, key, indicator, moments):
+        totals = self.groups.setdefault(key, {}).get(indicator)
+        if totals is None:
+            self.groups[key][indicator] = list(moments)
+            return
+        # parallel algorithm of Chan et al. for the mean and variance
+        n_a, mean_a, m2_a = totals[:3]
+        n_b, mean_b, m2_b = moments[:3]
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        totals[0] = n
+        totals[1] = mean_a + delta * n_b / n
+        totals[2] = m2_a + m2_b + delta * delta * n_a * n_b / n
+        totals[3] += moments[3]
+        totals[4] += moments[4]
+
+    def results(self):
+        """ Dict keyed by group (a tuple of the values of the group
+        columns) of dicts keyed by z-score column, with the number of
+        z-scores, their mean and SD, and the number and prevalence (in
+        percent) of z-scores below -2 and below -3 """
+        results = {}
+        for key, indicators in self.groups.items():
+            results[key] = {}
+            for indicator, (n, mean, m2, below_2, below_3) in\
+                    indicators.items():
+                results[key][indicator] = {
+                    'n': n, 'mean': mean,
+                    'sd': math.sqrt(m2 / (n - 1)) if n > 1 else float('nan'),
+                    'below_2': below_2, 'below_3': below_3,
+                    'prevalence_below_2': 100.0 * below_2 / n,
+                    'prevalence_below_3': 100.0 * below_3 / n}
+        return results
+
+
+class SurveyDesign(object):
+    """ Weighted sums of each (group, cluster) cell of a survey, from which
+    survey_estimates calculates point estimates and bootstrap replicates,
+    accumulated a chunk at a time like Prevalence:
+
+        design = SurveyDesign(by=['region'], weight='SW', cluster='psu')
+        for chunk in chunks:
+            design.add(chunk)
+        design.merge(other)     # e.g., from another process
+
+    Rows are their own clusters if cluster is None. For each indicator,
+    the cells have four sums: of the weights, of weighted z, and of the
+    weights of z < -2 and z < -3. Clusters are taken to be nested in
+    strata. Chunks merged in the order of the rows give the same design
+    as the whole survey added at once. """
+
+    def __init__(self, by=(), indicators=None, weight='SW', cluster=None,
+                 strata=None, exclude_flagged=True):
+        self.by = list(by)
+        self.indicators = list(indicators or INDICATORS)
+        self.weight = weight
+        self.cluster = cluster
+        self.strata = strata
+        self.exclude_flagged = exclude_flagged
+        self.rows = 0
+        # (group, cluster) of each cell, and the sums of each chunk's cells
+        self.cells = []
+        self.stats = []
+        # group => number of z-scores of each indicator
+        self.n = {}
+        # cluster => stratum (or None), in order of first appearance
+        self.clusters = {}
+
+    def add(self, columns):
+        """ Add a chunk, given as a dict of columns (or a DataFrame) with
+        the z-score, group, weight, cluster, and strata columns """
+        rows = len(columns[self.indicators[0]])
+        codes, groups = group_codes(group_columns(columns, self.by))
+        if codes is None:
+            codes = np.zeros(rows, dtype=np.int64)
+        if self.cluster is None:
+            clusters = np.arange(rows)
+            cluster_values = list(range(self.rows, self.rows + rows))
+        else:
+            clusters, cluster_values = group_codes([columns[self.cluster]])
+            cluster_values = [value for value, in cluster_values]
+        k = len(cluster_values) if rows else 0
+        strata = [None] * k
+        if self.strata is not None:
+            for c, stratum in zip(clusters.tolist(), np.asarray(
+                    columns[self.strata], dtype=object).tolist()):
+                strata[c] = stratum
+        for value, stratum in zip(cluster_values, strata):
+            self.clusters[value] = stratum
+        if self.weight is None:
+            weights = np.ones(rows)
+        else:
+            weights = vectorized.as_float_array(columns[self.weight])
+            weights[np.isnan(weights)] = 0
+
+        cells, cell_of_row = np.unique(codes * k + clusters,
+                                       return_inverse=True)
+        stats = np.zeros((len(cells), 4 * len(self.indicators)))
+        n = np.zeros((len(groups), len(self.indicators)), dtype=np.int64)
+        for j, indicator in enumerate(self.indicators):
+            z, valid = valid_zscores(columns, indicator,
+                                     self.exclude_flagged)
+            valid &= weights > 0
+            w = np.where(valid, weights, 0)
+            z = np.where(valid, z, 0)
+            for i, values in enumerate([w, w * z, w * (z < -2),
+                                        w * (z < -3)]):
+                stats[:, 4 * j + i] = np.bincount(
+                    cell_of_row, weights=values, minlength=len(cells))
+            n[:, j] = np.bincount(codes, weights=valid,
+                                  minlength=len(groups))
+        for g, key in enumerate(groups):
+            # not +=: the counts may be shared with a merged partial
+            if key in self.n:
+                self.n[key] = self.n[key] + n[g]
+            elif rows:
+                self.n[key] = n[g]
+        self.cells.extend((groups[cell // k], cluster_values[cell % k])
+                          for cell in cells.tolist())
+        self.stats.append(stats)
+        self.rows += rows
+        return self
+
+    def merge(self, other):
+        """ Add the cells of another SurveyDesign (of the same groups and
+        columns), e.g., from the next chunk or another process """
+        # rows that are their own clusters are numbered from here on
+        offset = self.rows if self.cluster is None else 0
+        for key, n in other.n.items():
+            if key in self.n:
+                self.n[key] = self.n[key] + n
+            else:
+                self.n[key] = n.copy()
+        for cluster, stratum in other.clusters.items():
+            self.clusters[cluster + offset if offset else cluster] = stratum
+        self.cells.extend((group, cluster + offset if offset else cluster)
+                          for group, cluster in other.cells)
+        self.stats.extend(other.stats)
+        self.rows += other.rows
+        return self
+
+    def design(self):
+        """ The cells summed by (group, cluster) and sorted by group, so
+        that the cells of group g are bounds[g]:bounds[g + 1], with the
+        clusters of each stratum, as used by _bootstrap_totals """
+        groups = list(self.n)
+        group_index = dict((key, g) for g, key in enumerate(groups))
+        cluster_index = dict((cluster, c)
+                             for c, cluster in enumerate(self.clusters))
+        k = len(cluster_index)
+        codes = np.array([group_index[group] * k + cluster_index[cluster]
+                          for group, cluster in self.cells], dtype=np.int64)
+        cells, cell_of_row = np.unique(codes, return_inverse=True)
+        width = 4 * len(self.indicators)
+        chunk_stats = np.concatenate(self.stats) if self.stats else\
+            np.zeros((0, width))
+        stats = np.zeros((len(cells), width))
+        for i in range(width):
+            stats[:, i] = np.bincount(cell_of_row, weights=chunk_stats[:, i],
+                                      minlength=len(cells))
+        if self.strata is None:
+            strata_members = [np.arange(k)]
+        else:
+            strata = {}
+            stratum = np.array([strata.setdefault(s, len(strata))
+                                for s in self.clusters.values()],
+                               dtype=np.int64)
+            strata_members = [np.flatnonzero(stratum == s)
+                              for s in range(len(strata))]
+        cell_group = cells // k if k else cells
+        return {'groups': groups, 'indicators': self.indicators,
+                'n': np.array([self.n[key] for key in groups],
+                              dtype=np.int64).reshape(len(groups), -1),
+                'bounds': np.searchsorted(cell_group,
+                                          np.arange(len(groups) + 1)),
+                'stats': stats, 'cell_cluster': cells % k if k else cells,
+                'clusters': k, 'strata': strata_members}
+
+    def results(self, replicates=1000, confidence=0.95, seed=None, jobs=1):
+        """ Estimates and bootstrap intervals, as survey_estimates """
+        return _design_estimates(self.design(), replicates, confidence,
+                                 seed, jobs)
+
+
+def _group_totals(design, multiplicity):
+    """ Sums of the cell statistics of each group, with each cell counted
+    the given number of times (rows: replicates; columns: cells) """
+    bounds, stats = design['bounds'], design['stats']
+    totals = np.empty((len(multiplicity), len(design['groups']),
+                       stats.shape[1]))
+    for g in range(len(design['groups'])):
+        lo, hi = bounds[g], bounds[g + 1]
+        totals[:, g] = np.dot(multiplicity[:, lo:hi], stats[lo:hi])
+    return totals
+
+
+def _bootstrap_totals(design, seed_sequence, replicates):
+    """ Group totals of replicates resamples of the clusters, drawn with
+    replacement within strata, as many at a time as fit in about
+    RESAMPLE_ELEMENTS draws """
+    rng = np.random.default_rng(seed_sequence)
+    k = design['clusters']
+    totals = []
+    step = max(1, RESAMPLE_ELEMENTS // max(k, 1))
+    for start in range(0, replicates, step):
+        b = min(step, replicates - start)
+        draws = np.concatenate(
+            [members[rng.integers(0, len(members), (b, len(members)))]
+             for members in design['strata'] if len(members)], axis=1)
+        counts = np.bincount((draws + k * np.arange(b)[:, None]).ravel(),
+                             minlength=b * k).reshape(b, k)
+        totals.append(_group_totals(
+            design, counts[:, design['cell_cluster']].astype(float)))
+    return np.concatenate(totals)
+
+
+_worker_design = None
+
+
+def _start_bootstrap_worker(design):
+    global _worker_design
+    _worker_design = design
+
+
+def _bootstrap_in_worker(task):
+    seed_sequence, replicates = task
+    return _bootstrap_totals(_worker_design, seed_sequence, replicates)
+
+
+def _estimates(totals):
+    """ Weighted mean of z and prevalences in percent, from group totals,
+    along the last axis """
+    w, wz, below_2, below_3 = [totals[..., i::4] for i in range(4)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'mean': wz / w,
+                'prevalence_below_2': 100 * below_2 / w,
+                'prevalence_below_3': 100 * below_3 / w}
+
+
+def survey_estimates(columns, by=(), indicators=None, weight='SW',
+                     cluster=None, strata=None, replicates=1000,
+                     confidence=0.95, seed=None, jobs=1,
+                     exclude_flagged=True):
+    """ Survey-weighted mean z and prevalence of z < -2 and z < -3 for each
+    group and z-score column, with bootstrap confidence intervals.
+
+    columns is a dict of columns (or a DataFrame) with the z-score, group,
+    and weight columns, and the cluster and strata columns if given.
+    Clusters (or rows, if cluster is None) are resampled with replacement
+    within strata. Replicates are drawn in blocks of REPLICATE_BLOCK, each
+    with its own random stream spawned from seed, so the intervals for a
+    given seed are the same whatever the number of jobs (worker
+    processes).
+
+    Returns a dict keyed by group of dicts keyed by z-score column, with
+    the number of z-scores, the estimates, and, if replicates, a
+    percentile interval for each (e.g., 'mean_ci': (low, high)). """
+    return SurveyDesign(by, indicators, weight, cluster, strata,
+                        exclude_flagged).add(columns).results(
+                            replicates, confidence, seed, jobs)
+
+
+def _design_estimates(design, replicates, confidence, seed, jobs):
+    """ survey_estimates of a SurveyDesign.design() """
+    multiplicity = np.ones((1, len(design['stats'])))
+    estimates = _estimates(_group_totals(design, multiplicity)[0])
+
+    intervals = None
+    if replicates:
+        blocks = [REPLICATE_BLOCK] * (replicates // REPLICATE_BLOCK)
+        if replicates % REPLICATE_BLOCK:
+            blocks.append(replicates % REPLICATE_BLOCK)
+        tasks = list(zip(np.random.SeedSequence(seed).spawn(len(blocks)),
+                         blocks))
+        if jobs > 1:
+            with futures.ProcessPoolExecutor(
+                    jobs, initializer=_start_bootstrap_worker,
+                    initargs=(design,)) as executor:
+                totals = list(executor.map(_bootstrap_in_worker, tasks))
+        else:
+            totals = [_bootstrap_totals(design, s, r) for s, r in tasks]
+        tail = 100 * (1 - confidence) / 2
+        with warnings.catch_warnings():
+            # groups with no z-scores in some or all of the replicates
+            warnings.simplefilter('ignore', RuntimeWarning)
+            intervals = dict(
+                (name, np.nanpercentile(values, [tail, 100 - tail], axis=0))
+                for name, values in
+                _estimates(np.concatenate(totals)).items())
+
+    results = {}
+    for g, key in enumerate(design['groups']):
+        results[key] = {}
+        for j, indicator in enumerate(design['indicators']):
+            n = int(design['n'][g, j])
+            if not n:
+                continue
+            r = {'n': n}
+            for name, values in estimates.items():
+                r[name] = float(values[g, j])
+                if intervals is not None:
+                    r[name + '_ci'] = (float(intervals[name][0, g, j]),
+                                       float(intervals[name][1, g, j]))
+            results[key][indicator] = r
+    return results
+
+
+def scored_columns(calculator, header, records):
+    """ Columns of CSV records (lines) with the given header, plus those
+    added by the batch engine (_ZWEI, ..., _FBMI) """
+    columns, count = batch.records_to_columns(header, records)
+    columns = dict(zip(header, columns))
+    columns.update(batch.score_columns(calculator, columns))
+    return columns
+
+
+def _prevalence_of_records(calculator, header, records, by):
+    return Prevalence(by).add(scored_columns(calculator, header, records))
+
+
+def _prevalence_in_worker(task):
+    header, records, by = task
+    return _prevalence_of_records(batch._worker_calculator, header, records,
+                                  by)
+
+
+def survey_prevalence(infile, by=(), calculator=None,
+                      chunk_size=batch.CHUNK_SIZE, jobs=1):
+    """ Score a survey CSV (as python -m pygrowup.batch does) from the file
+    object infile, and aggregate the z-scores by the group columns in by.
+    Chunks are scored and aggregated in worker processes if jobs > 1,
+    and only their partial results are returned and merged. Returns a
+    Prevalence. """
+    if calculator is None:
+        calculator = pygrowup.Calculator()
+    records = batch.read_records(infile)
+    header = next(csv.reader([next(records)], dialect='excel'))
+    chunks = batch.read_chunks(records, chunk_size)
+    prevalence = Prevalence(by)
+    if jobs > 1:
+        executor = batch.worker_pool(calculator, jobs)
+        try:
+            for partial in batch.imap_ordered(
+                    executor, _prevalence_in_worker,
+                    ((header, chunk, list(by)) for chunk in chunks),
+                    window=2 * jobs):
+                prevalence.merge(partial)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    else:
+        for chunk in chunks:
+            prevalence.merge(_prevalence_of_records(calculator, header,
+                                                    chunk, by))
+    return prevalence
+
+
+def _design_of_records(calculator, header, records, options):
+    return SurveyDesign(**options).add(scored_columns(calculator, header,
+                                                      records))
+
+
+def _design_in_worker(task):
+    header, records, options = task
+    return _design_of_records(batch._worker_calculator, header, records,
+                              options)
+
+
+def survey_design(infile, by=(), weight='SW', cluster=None, strata=None,
+                  calculator=None, chunk_size=batch.CHUNK_SIZE, jobs=1):
+    """ Score a survey CSV from the file object infile, as
+    survey_prevalence does, and sum the weighted z-scores of each (group,
+    cluster) cell a chunk at a time, in worker processes if jobs > 1.
+    Returns a SurveyDesign, whose results are survey_estimates. """
+    if calculator is None:
+        calculator = pygrowup.Calculator()
+    options = {'by': list(by), 'weight': weight, 'cluster': cluster,
+               'strata': strata}
+    records = batch.read_records(infile)
+    header = next(csv.reader([next(records)], dialect='excel'))
+    chunks = batch.read_chunks(records, chunk_size)
+    design = SurveyDesign(**options)
+    if jobs > 1:
+        executor = batch.worker_pool(calculator, jobs)
+        try:
+            # merged in order, so that rows (and clusters) are numbered
+            # as if the survey were read at once
+            for partial in batch.imap_ordered(
+                    executor, _design_in_worker,
+                    ((header, chunk, options) for chunk in chunks),
+                    window=2 * jobs):
+                design.merge(partial)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    else:
+        for chunk in chunks:
+            design.merge(_design_of_records(calculator, header, chunk,
+                                            options))
+    return design
+
+
+def _write_prevalence(writer, by, prevalence):
+    writer.writerow(by + ['indicator', 'n', 'mean', 'sd', '% < -2',
+                          '% < -3'])
+    results = prevalence.results()
+    for key in sorted(results, key=lambda k: [str(v) for v in k]):
+        for indicator in prevalence.indicators:
+            r = results[key].get(indicator)
+            if r is not None:
+                writer.writerow(list(key) + [
+                    INDICATORS.get(indicator, indicator), r['n'],
+                    '%.2f' % r['mean'], '%.2f' % r['sd'],
+                    '%.1f' % r['prevalence_below_2'],
+                    '%.1f' % r['prevalence_below_3']])
+
+
+def _write_estimates(writer, by, results):
+    writer.writerow(by + ['indicator', 'n', 'mean', 'mean CI',
+                          '% < -2', '% < -2 CI', '% < -3', '% < -3 CI'])
+    for key in sorted(results, key=lambda k: [str(v) for v in k]):
+        for indicator in INDICATORS:
+            r = results[key].get(indicator)
+            if r is None:
+                continue
+            row = list(key) + [INDICATORS[indicator], r['n']]
+            for name, fmt in [('mean', '%.2f'), ('prevalence_below_2', '%.1f'),
+                              ('prevalence_below_3', '%.1f')]:
+                row.append(fmt % r[name])
+                if name + '_ci' in r:
+                    row.append((fmt + ' to ' + fmt) % r[name + '_ci'])
+                else:
+                    row.append('')
+            writer.writerow(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pygrowup.aggregate',
+        description='Prevalence of stunting, wasting, and underweight.')
+    parser.add_argument('input', help="survey CSV, or '-' for stdin")
+    parser.add_argument('--by', action='append', default=[],
+                        help="group column (e.g., region), or 'age_band' or "
+                        "'sex'; may be repeated")
+    parser.add_argument('--chunk-size', type=int, default=batch.CHUNK_SIZE,
+                        help='rows scored at a time (default %(default)s)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='worker processes (default %(default)s)')
+    parser.add_argument('--weight',
+                        help='sampling weight column (e.g., SW): estimate '
+                        'weighted prevalences with bootstrap intervals')
+    parser.add_argument('--cluster', help='cluster (PSU) column to resample')
+    parser.add_argument('--strata', help='strata column')
+    parser.add_argument('--replicates', type=int, default=1000,
+                        help='bootstrap replicates (default %(default)s)')
+    parser.add_argument('--seed', type=int,
+                        help='random seed, for reproducible intervals')
+    parser.add_argument('--cdc', action='store_true',
+                        help='use CDC tables for children over 24 months')
+    args = parser.parse_args(argv)
+
+    calculator = pygrowup.Calculator(include_cdc=args.cdc)
+    infile = sys.stdin if args.input == '-' else open(
+        args.input, 'r', newline='', encoding='utf-8', errors='ignore')
+    try:
+        if args.weight:
+            design = survey_design(infile, args.by, weight=args.weight,
+                                   cluster=args.cluster, strata=args.strata,
+                                   calculator=calculator,
+                                   chunk_size=args.chunk_size,
+                                   jobs=args.jobs)
+        else:
+            prevalence = survey_prevalence(infile, args.by, calculator,
+                                           chunk_size=args.chunk_size,
+                                           jobs=args.jobs)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    if not args.weight:
+        _write_prevalence(writer, args.by, prevalence)
+        return prevalence
+    results = design.results(replicates=args.replicates, seed=args.seed,
+                             jobs=args.jobs)
+    _write_estimates(writer, args.by, results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Batch z-scores for survey files laid out like the WHO Anthro survey
+    export in testdata/ (GENDER, agemons, WEIGHT, HEIGHT, measure,
+    oedema, ...).
+
+    The input is read and scored a chunk of rows at a time, so memory use
+    depends on the chunk size rather than on the size of the file. The
+    output has every input column, followed by (or, if already present,
+    replaced with) the WHO Anthro columns _CLENHEI, _CBMI, _ZWEI, _ZLEN,
+    _ZWFL, _ZBMI, _FWEI, _FLEN, _FWFL, and _FBMI.
+
+    python -m pygrowup.batch survey.csv scored.csv [--chunk-size N]
+                                                   [--jobs N]
+
+    Parquet and Arrow (Feather) surveys, e.g. survey.parquet, are scored a
+    row group at a time, with the results appended as columns. These need
+    pyarrow.
+"""
+import io
+import os
+import sys
+import csv
+import time
+import argparse
+import itertools
+import collections
+from concurrent import futures
+
+import numpy as np
+
+from . import exceptions
+from . import helpers
+from . import pygrowup
+from . import tablestore
+from . import vectorized
+
+
+CHUNK_SIZE = 50000
+
+REQUIRED_COLUMNS = ['GENDER', 'agemons', 'WEIGHT', 'HEIGHT']
+
+DERIVED_COLUMNS = ['_CLENHEI', '_CBMI']
+ZSCORE_COLUMNS = ['_ZWEI', '_ZLEN', '_ZWFL', '_ZBMI']
+FLAG_COLUMNS = ['_FWEI', '_FLEN', '_FWFL', '_FBMI']
+OUTPUT_COLUMNS = DERIVED_COLUMNS + ZSCORE_COLUMNS + FLAG_COLUMNS
+
+# indicator of each z-score column, for its flag limits
+# (see vectorized.FLAG_LIMITS)
+ZSCORE_INDICATORS = {'_ZWEI': 'wfa', '_ZLEN': 'lhfa', '_ZWFL': 'wfl',
+                     '_ZBMI': 'bmifa'}
+
+# Parquet and Arrow files (see process_columnar) by extension
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet',
+                    '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+
+def survey_sexes(values, unmapped=None):
+    """ Column of sexes coded 1/2 (or M/F, L/P, etc., see
+    helpers.SEX_TOKENS) as an array of 'M' and 'F'. Values not
+    recognized are '', and counted in unmapped if it is a Counter. """
+    sexes, counts = helpers.get_good_sexes(values)
+    if unmapped is not None:
+        unmapped.update(counts)
+    return sexes
+
+
+def score_columns(calculator, columns, unmapped=None):
+    """ Score one chunk of a survey, given as a dict of columns keyed by
+    survey column name. Returns a dict of float64 arrays keyed by output
+    column name, with NaN where WHO Anthro leaves a blank. GENDER values
+    not recognized (and so not scored) are counted in unmapped if it is
+    a Counter.
+
+    As in WHO Anthro, lengths measured standing (measure 'h') under 24
+    months have 0.7cm added, heights measured lying ('l') from 24 months
+    have 0.7cm subtracted, and children with oedema get no weight-based
+    z-scores. """
+    weights, ages, sexes, heights = vectorized.prepare_columns(
+        columns['WEIGHT'], columns['agemons'],
+        survey_sexes(columns['GENDER'], unmapped), columns['HEIGHT'])
+
+    if 'measure' in columns:
+        measure = vectorized.as_code_array(columns['measure'])
+        heights = np.where((measure == 'L') & (ages >= 24), heights - 0.7,
+                           np.where((measure == 'H') & (ages < 24),
+                                    heights + 0.7, heights))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bmi = weights / (heights / 100) ** 2
+    if 'oedema' in columns:
+        oedema = vectorized.as_code_array(columns['oedema']) == 'Y'
+        weights = np.where(oedema, np.nan, weights)
+        bmi_scored = np.where(oedema, np.nan, bmi)
+    else:
+        bmi_scored = bmi
+
+    def zscores(indicator, measurements):
+        # columns are already parsed, so skip zscores_batch
+        return vectorized._zscores(calculator, indicator, measurements, ages,
+                                   sexes, heights)
+    under_24 = ages < 24
+    results = {
+        '_CLENHEI': heights,
+        '_CBMI': bmi,
+        '_ZWEI': zscores('wfa', weights),
+        '_ZLEN': zscores('lhfa', heights),
+        '_ZWFL': np.where(under_24,
+                          zscores('wfl', np.where(under_24, weights, np.nan)),
+                          zscores('wfh', np.where(under_24, np.nan, weights))),
+        '_ZBMI': zscores('bmifa', bmi_scored),
+    }
+    for zscore_column, flag_column in zip(ZSCORE_COLUMNS, FLAG_COLUMNS):
+        results[flag_column] = vectorized.flag_zscores(
+            ZSCORE_INDICATORS[zscore_column], results[zscore_column])
+    return results
+
+
+def count_flags(results):
+    """ Rows scored and flagged for each flag column of score_columns,
+    e.g. {'_FWEI': {'scored': 480, 'flagged': 2}, ...} """
+    return dict((name, vectorized.count_flags(results[name]))
+                for name in FLAG_COLUMNS)
+
+
+def add_flag_counts(totals, counts):
+    """ Add the count_flags of one chunk to totals (or start totals if
+    it is None), so that counts from any number of chunks and worker
+    processes can be combined """
+    if totals is None:
+        return dict((name, dict(c)) for name, c in counts.items())
+    for name, c in counts.items():
+        for key, count in c.items():
+            totals[name][key] += count
+    return totals
+
+
+def format_column(name, values):
+    """ Output column as strings, with blanks for NaN """
+    if name in FLAG_COLUMNS:
+        text = np.where(values == 1, '1', '0')
+        return np.where(np.isnan(values), '', text).tolist()
+    template = '%.2f' if name in ZSCORE_COLUMNS else '%.8g'
+    # NaN is the only value not equal to itself
+    text = [template % v if v == v else '' for v in values.tolist()]
+    if name in ZSCORE_COLUMNS:
+        # -0.0 and small negatives would be written as '-0.00'
+        text = ['0.00' if t == '-0.00' else t for t in text]
+    return text
+
+
+def read_records(infile):
+    """ Lines of CSV text from a file, joined where a quoted value spans
+    lines, so that each string is one whole record. Blank lines are
+    skipped. """
+    pending = ''
+    for line in infile:
+        if pending:
+            line = pending + line
+        # quotes within a quoted value are doubled, so an odd count
+        # means the record continues on the next line
+        if line.count('"') % 2:
+            pending = line
+            continue
+        pending = ''
+        if line.strip():
+            yield line
+    if pending:
+        yield pending
+
+
+def read_chunks(records, chunk_size=CHUNK_SIZE):
+    """ Lists of up to chunk_size items (e.g., records) from an iterator """
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def records_to_columns(header, records):
+    """ A list of CSV records (see read_records) as a list of columns, one
+    for each name in header, and the number of rows. Short rows are
+    padded with blanks, long rows truncated, and empty rows skipped. """
+    rows = [row for row in csv.reader(records, dialect='excel') if row]
+    width = len(header)
+    columns = [list(c) for c in itertools.zip_longest(
+        *rows, fillvalue='')][:width]
+    columns += [[''] * len(rows) for i in range(width - len(columns))]
+    return columns, len(rows)
+
+
+def score_records(calculator, header, records):
+    """ Score a list of CSV records (see read_records) with the given
+    header. Returns the scored records as CSV text, their count, the
+    count_flags of the records, and a Counter of their GENDER values
+    that were not recognized. """
+    columns, count = records_to_columns(header, records)
+    width = len(header)
+    output_header = header + [c for c in OUTPUT_COLUMNS if c not in header]
+    unmapped = collections.Counter()
+    results = score_columns(calculator, dict(zip(header, columns)),
+                            unmapped)
+    columns += [None] * (len(output_header) - width)
+    for name in OUTPUT_COLUMNS:
+        columns[output_header.index(name)] = format_column(
+            name, results[name])
+    text = io.StringIO()
+    writer = csv.writer(text, dialect='excel', lineterminator='\n')
+    writer.writerows(zip(*columns))
+    return text.getvalue(), count, count_flags(results), unmapped
+
+
+# Calculator of each worker process (see process)
+_worker_calculator = None
+
+
+def _start_worker(options):
+    global _worker_calculator
+    _worker_calculator = pygrowup.Calculator(**options)
+
+
+def _score_in_worker(task):
+    header, records = task
+    return score_records(_worker_calculator, header, records)
+
+
+def worker_pool(calculator, jobs):
+    """ Pool of jobs worker processes, each with a Calculator set up like
+    calculator """
+    tablestore.preload(calculator.include_cdc)
+    options = {'adjust_height_data': calculator.adjust_height_data,
+               'adjust_weight_scores': calculator.adjust_weight_scores,
+               'include_cdc': calculator.include_cdc}
+    return futures.ProcessPoolExecutor(jobs, initializer=_start_worker,
+                                       initargs=(options,))
+
+
+def imap_ordered(executor, fn, tasks, window):
+    """ Results of fn for each task, run in the executor and returned in
+    the order of the tasks, with at most window tasks in flight (unlike
+    Pool.imap, which reads all of its input ahead). """
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def process(infile, outfile, calculator=None, chunk_size=CHUNK_SIZE,
+            jobs=1):
+    """ Score a survey CSV from the file object infile, writing the scored
+    CSV to outfile. Returns a dict with the number of rows scored, the
+    seconds taken, rows per second, the rows scored and flagged for
+    each flag column (see count_flags), and the number of rows with each
+    GENDER value that was not recognized (and so not scored).
+
+    With jobs > 1, chunks are parsed and scored by a pool of worker
+    processes, and written out in input order. Workers do not receive
+    the tables from this process: they use the compiled tables, which
+    are memory-mapped and so shared between processes by the OS (and,
+    where workers are forked, already loaded by preload). """
+    if calculator is None:
+        calculator = pygrowup.Calculator()
+    started = time.time()
+    records = read_records(infile)
+    try:
+        header = next(csv.reader([next(records)], dialect='excel'))
+    except StopIteration:
+        raise exceptions.DataError('no header row')
+    missing = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing:
+        raise exceptions.DataError('missing columns: %s' % ', '.join(missing))
+
+    output_header = header + [c for c in OUTPUT_COLUMNS if c not in header]
+    writer = csv.writer(outfile, dialect='excel', lineterminator='\n')
+    writer.writerow(output_header)
+
+    chunks = read_chunks(records, chunk_size)
+    if jobs > 1:
+        executor = worker_pool(calculator, jobs)
+        results = imap_ordered(executor, _score_in_worker,
+                               ((header, chunk) for chunk in chunks),
+                               window=2 * jobs)
+    else:
+        executor = None
+        results = (score_records(calculator, header, chunk)
+                   for chunk in chunks)
+
+    rows = 0
+    flags = None
+    unmapped = collections.Counter()
+    try:
+        for text, count, chunk_flags, chunk_unmapped in results:
+            outfile.write(text)
+            rows += count
+            flags = add_flag_counts(flags, chunk_flags)
+            unmapped.update(chunk_unmapped)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return _stats(rows, flags, unmapped, started)
+
+
+def _stats(rows, flags, unmapped, started):
+    if flags is None:
+        flags = count_flags(dict((name, np.array([]))
+                                 for name in FLAG_COLUMNS))
+    seconds = time.time() - started
+    return {'rows': rows, 'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else float('inf'),
+            'flags': flags, 'unmapped_sexes': dict(unmapped)}
+
+
+def columnar_format(path):
+    """ 'parquet' or 'arrow' (IPC file format, also known as Feather v2)
+    by file extension, or None for anything else """
+    return COLUMNAR_FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet and Arrow files need pyarrow '
+                          '(pip install pyarrow)')
+    return pyarrow
+
+
+def count_parts(path):
+    """ Number of row groups (Parquet) or record batches (Arrow) in a file """
+    pa = _import_pyarrow()
+    if columnar_format(path) == 'parquet':
+        return pa.parquet.ParquetFile(path).num_row_groups
+    return pa.ipc.open_file(pa.memory_map(path)).num_record_batches
+
+
+def read_part(path, index):
+    """ One row group or record batch of a file, as a pyarrow Table. Arrow
+    files are memory-mapped, so their columns are not copied. """
+    pa = _import_pyarrow()
+    if columnar_format(path) == 'parquet':
+        return pa.parquet.ParquetFile(path).read_row_group(index)
+    batch = pa.ipc.open_file(pa.memory_map(path)).get_batch(index)
+    return pa.Table.from_batches([batch])
+
+
+def score_table(calculator, table, unmapped=None):
+    """ Score a pyarrow Table (or RecordBatch), returning a Table with the
+    output columns appended, or replaced if already present. Blanks are
+    nulls, and flags are int8. GENDER values not recognized are counted
+    in unmapped if it is a Counter. """
+    pa = _import_pyarrow()
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+    missing = [c for c in REQUIRED_COLUMNS if c not in table.column_names]
+    if missing:
+        raise exceptions.DataError('missing columns: %s' % ', '.join(missing))
+    # numeric columns without nulls are views of the Arrow buffers
+    columns = dict((name, table.column(name).to_numpy())
+                   for name in REQUIRED_COLUMNS + ['measure', 'oedema']
+                   if name in table.column_names)
+    results = score_columns(calculator, columns, unmapped)
+    for name in OUTPUT_COLUMNS:
+        values = results[name]
+        blank = np.isnan(values)
+        if name in FLAG_COLUMNS:
+            column = pa.array(np.where(blank, 0, values).astype(np.int8),
+                              mask=blank)
+        else:
+            column = pa.array(values, mask=blank)
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name,
+                                     column)
+        else:
+            table = table.append_column(name, column)
+    return table
+
+
+def _score_part(calculator, path, index):
+    unmapped = collections.Counter()
+    return score_table(calculator, read_part(path, index), unmapped), unmapped
+
+
+def _score_part_in_worker(task):
+    path, index = task
+    return _score_part(_worker_calculator, path, index)
+
+
+def process_columnar(input_path, output_path, calculator=None, jobs=1):
+    """ Score a survey stored as Parquet or Arrow, writing the scored
+    survey to output_path (Parquet or Arrow, by extension). The input is
+    read one row group (or record batch) at a time, so memory use is
+    bounded by the row group size. Returns the same stats as process. """
+    pa = _import_pyarrow()
+    for path in [input_path, output_path]:
+        if columnar_format(path) is None:
+            raise exceptions.DataError('not a Parquet or Arrow file: %s'
+                                       % path)
+    if calculator is None:
+        calculator = pygrowup.Calculator()
+    started = time.time()
+    parts = range(count_parts(input_path))
+    if jobs > 1:
+        executor = worker_pool(calculator, jobs)
+        results = imap_ordered(executor, _score_part_in_worker,
+                               ((input_path, i) for i in parts),
+                               window=2 * jobs)
+    else:
+        executor = None
+        results = (_score_part(calculator, input_path, i) for i in parts)
+
+    rows = 0
+    flags = None
+    unmapped = collections.Counter()
+    writer = None
+    try:
+        for table, part_unmapped in results:
+            if writer is None:
+                writer = _open_writer(pa, output_path, table.schema)
+            writer.write_table(table)
+            rows += table.num_rows
+            flags = add_flag_counts(flags, count_flags(dict(
+                (name, table.column(name).to_numpy(
+                    zero_copy_only=False).astype(np.float64))
+                for name in FLAG_COLUMNS)))
+            unmapped.update(part_unmapped)
+        if writer is None:
+            # no rows: still write the scored schema
+            if columnar_format(input_path) == 'parquet':
+                schema = pa.parquet.read_schema(input_path)
+            else:
+                schema = pa.ipc.open_file(pa.memory_map(input_path)).schema
+            table = score_table(calculator, schema.empty_table())
+            writer = _open_writer(pa, output_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return _stats(rows, flags, unmapped, started)
+
+
+def _open_writer(pa, path, schema):
+    if columnar_format(path) == 'parquet':
+        return pa.parquet.ParquetWriter(path, schema)
+    return pa.ipc.new_file(path, schema)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pygrowup.batch',
+        description='Add WHO z-scores and flags to a survey.')
+    parser.add_argument('input', help="survey CSV, Parquet or Arrow file, "
+                        "or '-' for CSV on stdin")
+    parser.add_argument('output', help="scored CSV, Parquet or Arrow file, "
+                        "or '-' for CSV on stdout")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='rows scored at a time (default %(default)s)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='worker processes, or 0 for one per CPU '
+                        '(default %(default)s)')
+    parser.add_argument('--cdc', action='store_true',
+                        help='use CDC tables for children over 24 months')
+    parser.add_argument('--adjust-weight-scores', action='store_true',
+                        help='restricted application of the LMS method')
+    args = parser.parse_args(argv)
+
+    calculator = pygrowup.Calculator(
+        include_cdc=args.cdc, adjust_weight_scores=args.adjust_weight_scores)
+    jobs = args.jobs or os.cpu_count()
+    if columnar_format(args.input) or columnar_format(args.output):
+        try:
+            stats = process_columnar(args.input, args.output, calculator,
+                                     jobs)
+        except exceptions.DataError as e:
+            parser.exit(1, '%s\n' % e)
+        return _report(stats)
+
+    infile = sys.stdin if args.input == '-' else open(
+        args.input, 'r', newline='', encoding='utf-8', errors='ignore')
+    outfile = sys.stdout if args.output == '-' else open(
+        args.output, 'w', newline='', encoding='utf-8')
+    try:
+        stats = process(infile, outfile, calculator, args.chunk_size, jobs)
+    except exceptions.DataError as e:
+        parser.exit(1, '%s: %s\n' % (args.input, e))
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+    return _report(stats)
+
+
+def _report(stats):
+    sys.stderr.write('scored %(rows)d rows in %(seconds).2fs '
+                     '(%(rows_per_second).0f rows/sec)\n' % stats)
+    sys.stderr.write('flagged: %s\n' % ', '.join(
+        '%s %d of %d' % (name, stats['flags'][name]['flagged'],
+                         stats['flags'][name]['scored'])
+        for name in FLAG_COLUMNS))
+    unmapped = stats['unmapped_sexes']
+    if unmapped:
+        sys.stderr.write('not scored, GENDER not recognized: %s\n' % ', '.join(
+            '%r %d' % (value, count) for value, count in
+            sorted(unmapped.items(), key=lambda item: -item[1])))
+    return stats
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Benchmarks of the pygrowup hot paths.
+
+    python -m pygrowup.benchmarks [--rows N] [--output results.json]
+                                  [--compare previous.json]
+
+    Measures Calculator() construction, the latency of single
+    zscore_for_measurement calls per indicator, batch throughput over the
+    bundled survey files replicated to --rows rows (1M by default), and
+    peak memory. Results are written as JSON so that runs before and after
+    a change can be compared.
+"""
+import gc
+import sys
+import time
+import platform
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import numpy as np
+
+from .. import dispatch
+from .. import parity
+from .. import pygrowup
+from .. import tablestore
+from .. import vectorized
+from .. import get_version
+
+
+ROWS = 1000000
+
+LATENCY_INDICATORS = ['wfa', 'lhfa', 'wfl', 'wfh', 'bmifa', 'hcfa']
+
+
+def percentiles(seconds):
+    """ Summary of a list of timings, in microseconds """
+    us = np.asarray(seconds) * 1e6
+    return {'calls': len(us),
+            'mean_us': round(float(us.mean()), 2),
+            'p50_us': round(float(np.percentile(us, 50)), 2),
+            'p99_us': round(float(np.percentile(us, 99)), 2)}
+
+
+def survey_rows():
+    """ Rows of both bundled survey files """
+    rows = []
+    for file_name in parity.SURVEY_FILES:
+        rows.extend(parity.read_survey(file_name))
+    return rows
+
+
+def bench_construction(repeat=100):
+    """ Calculator() with the shared tables not yet loaded (cold), and
+    once they have been (warm) """
+    cold = []
+    for i in range(5):
+        tablestore._registry.clear()
+        dispatch._dispatch.clear()
+        started = time.perf_counter()
+        pygrowup.Calculator(include_cdc=True)
+        dispatch.get_dispatch()
+        cold.append(time.perf_counter() - started)
+    warm = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        pygrowup.Calculator(include_cdc=True)
+        warm.append(time.perf_counter() - started)
+    return {'cold': percentiles(cold), 'warm': percentiles(warm)}
+
+
+def scorable(calc, args):
+    try:
+        calc.zscore_for_measurement(*args)
+    except (AssertionError, RuntimeError, ArithmeticError, ValueError):
+        return False
+    return True
+
+
+def bench_latency(rows, precision='decimal', calls=2000):
+    """ zscore_for_measurement, one indicator at a time, over survey rows
+    that can be scored for that indicator """
+    calc = pygrowup.Calculator(include_cdc=True, precision=precision)
+    results = {}
+    for indicator in LATENCY_INDICATORS:
+        column = parity.MEASUREMENT_COLUMNS[indicator]
+        args = [(indicator, row[column], row['agemons'], row['GENDER'],
+                 row['HEIGHT']) for row in rows]
+        args = [a for a in args if scorable(calc, a)]
+        args = (args * (calls // len(args) + 1))[:calls]
+        timings = []
+        for a in args:
+            started = time.perf_counter()
+            calc.zscore_for_measurement(*a)
+            timings.append(time.perf_counter() - started)
+        results[indicator] = percentiles(timings)
+    return results
+
+
+def replicate(rows, size):
+    """ Survey columns as arrays, repeated to size rows """
+    columns = {}
+    for name in ['WEIGHT', 'HEIGHT', 'agemons', 'GENDER', 'HEAD']:
+        values = [row[name] for row in rows]
+        if name != 'GENDER':
+            values = vectorized.as_float_array(values)
+        columns[name] = np.resize(np.asarray(values), size)
+    return columns
+
+
+def bench_batch(rows, size=ROWS, repeat=3):
+    """ all_indicators_batch over survey rows replicated to size rows,
+    with the peak memory allocated while scoring """
+    columns = replicate(rows, size)
+    calc = pygrowup.Calculator(include_cdc=True)
+
+    def run():
+        return calc.all_indicators_batch(
+            columns['WEIGHT'], columns['HEIGHT'], columns['agemons'],
+            columns['GENDER'], columns['HEAD'])
+    run()
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(timings)
+    return {'rows': size, 'best_seconds': round(best, 4),
+            'rows_per_second': round(size / best),
+            'peak_traced_bytes': peak}
+
+
+def environment():
+    return {'pygrowup': get_version(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+def run(size=ROWS):
+    """ Run every benchmark and return the results as a dict """
+    rows = survey_rows()
+    results = {'environment': environment(),
+               'construction': bench_construction(),
+               'latency': {'decimal': bench_latency(rows, 'decimal'),
+                           'float': bench_latency(rows, 'float')},
+               'batch': bench_batch(rows, size)}
+    results['peak_rss_bytes'] = peak_rss()
+    return results
+
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+import sys
+import json
+import argparse
+
+from . import ROWS, run
+
+
+def flatten(results, prefix=''):
+    """ Numeric results keyed by dotted path, e.g. batch.rows_per_second """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(previous, current):
+    """ Print each result of a previous run next to the current one """
+    before, after = flatten(previous), flatten(current)
+    for key in sorted(set(before) & set(after)):
+        ratio = after[key] / before[key] if before[key] else float('nan')
+        print('%-40s %14.6g %14.6g %8.2fx' % (key, before[key], after[key],
+                                              ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pygrowup.benchmarks',
+        description='Benchmark the pygrowup hot paths.')
+    parser.add_argument('--rows', type=int, default=ROWS,
+                        help='rows in the batch benchmark '
+                        '(default %(default)s)')
+    parser.add_argument('--output', help='write results as JSON to this '
+                        'file (default stdout)')
+    parser.add_argument('--compare', metavar='PREVIOUS',
+                        help='compare with the JSON results of an earlier run')
+    args = parser.parse_args(argv)
+
+    results = run(args.rows)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Conformance of pygrowup with the z-scores calculated by WHO Anthro for
+    the survey files bundled in testdata/.
+
+    Both files are read once and every indicator is calculated in bulk,
+    then compared with the WHO reference columns:
+
+    python -m pygrowup.conformance [--tolerance 1] [--verbose]
+"""
+import csv
+import argparse
+
+import numpy as np
+
+from . import pygrowup
+from .parity import MEASUREMENT_COLUMNS, SURVEY_FILES, open_survey
+
+
+# WHO Anthro column holding the reference z-score for each indicator.
+# Note that both wfl and wfh are compared with _ZWFL at every age.
+REFERENCE_COLUMNS = {'lhfa': '_ZLEN', 'wfl': '_ZWFL', 'wfh': '_ZWFL',
+                     'wfa': '_ZWEI', 'bmifa': '_ZBMI'}
+
+# WHO Anthro uses daily tables where pygrowup uses monthly ones, and
+# measurements are scored as recorded, without the measuring position
+# or oedema taken into account, so differences of up to 1 are expected
+TOLERANCE = 1.0
+
+# rows left out of the comparison
+SKIPPED_IDS = ['287', '381']
+
+# (indicator, id) of rows known to differ by more than TOLERANCE: lengths
+# just under 4 months, scored against the monthly table here, and a very
+# low weight at 31 months, scored against the CDC table (include_cdc)
+KNOWN_OUTLIERS = [('lhfa', '136'), ('lhfa', '210'), ('lhfa', '397'),
+                  ('wfa', '371')]
+
+
+def load_surveys(file_names=SURVEY_FILES):
+    """ Columns of the survey files, concatenated, as a dict of lists
+    keyed by column name (plus 'file') """
+    columns = {}
+    for file_name in file_names:
+        with open_survey(file_name) as f:
+            reader = csv.reader(f, dialect='excel')
+            header = next(reader)
+            rows = list(reader)
+        for name, column in zip(header, zip(*rows)):
+            columns.setdefault(name, []).extend(column)
+        columns.setdefault('file', []).extend([file_name] * len(rows))
+    return columns
+
+
+def conformance(calculator=None, columns=None, tolerance=TOLERANCE):
+    """ Compare z-scores with WHO Anthro's, row by row.
+
+    Returns a dict keyed by indicator with the number of rows compared,
+    the maximum and 99th percentile of the absolute differences, the
+    number of rows differing by more than tolerance (and those rows, as
+    (file, id, ours, theirs) tuples), and the number of rows scored by
+    WHO Anthro that pygrowup did not score. """
+    if calculator is None:
+        calculator = pygrowup.Calculator(include_cdc=True)
+    if columns is None:
+        columns = load_surveys()
+    ids = np.array(columns['id'])
+    sexes = np.array([{'1': 'M', '2': 'F'}.get(g, '')
+                      for g in columns['GENDER']])
+    skipped = np.isin(ids, SKIPPED_IDS)
+
+    report = {}
+    for indicator, reference_column in sorted(REFERENCE_COLUMNS.items()):
+        measurements = columns[MEASUREMENT_COLUMNS[indicator]]
+        heights = None if indicator == 'bmifa' else columns['HEIGHT']
+        ours = calculator.zscores_batch(indicator, measurements,
+                                        columns['agemons'], sexes, heights)
+        theirs = np.array([float(v) if v.strip() else np.nan
+                           for v in columns[reference_column]])
+        compared = ~skipped & ~np.isnan(ours) & ~np.isnan(theirs)
+        diffs = np.abs(ours - theirs)[compared]
+        above = np.flatnonzero(compared & (np.abs(ours - theirs) > tolerance))
+        report[indicator] = {
+            'rows': int(compared.sum()),
+            'max': float(diffs.max()) if diffs.size else 0.0,
+            'p99': float(np.percentile(diffs, 99)) if diffs.size else 0.0,
+            'above_tolerance': len(above),
+            'outliers': [(columns['file'][i], ids[i], ours[i], theirs[i])
+                         for i in above],
+            'unscored': int((~skipped & np.isnan(ours) &
+                             ~np.isnan(theirs)).sum())}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pygrowup.conformance',
+        description='Compare z-scores with those of WHO Anthro.')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='largest acceptable difference '
+                        '(default %(default)s)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='list rows differing by more than tolerance')
+    args = parser.parse_args(argv)
+
+    report = conformance(tolerance=args.tolerance)
+    print('%-8s %6s %6s %6s %8s %9s' % ('', 'rows', 'max', 'p99',
+                                        '> %g' % args.tolerance,
+                                        'unscored'))
+    for indicator, r in sorted(report.items()):
+        print('%-8s %6d %6.2f %6.2f %8d %9d' % (
+            indicator, r['rows'], r['max'], r['p99'], r['above_tolerance'],
+            r['unscored']))
+        if args.verbose:
+            for file_name, row_id, ours, theirs in r['outliers']:
+                print('    %s id %s: %.2f (WHO %.2f)' % (
+                    file_name, row_id, ours, theirs))
+    return report
+
+
+if __name__ == '__main__':
+    main()
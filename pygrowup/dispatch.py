@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Precomputed choice of WHO/CDC table for an observation.
+
+    Which table an observation is scored against depends only on the
+    indicator, the sex, a handful of age and height cutoffs, and whether
+    CDC tables are in use. Every combination is resolved once, when the
+    tables are first used, into a dict whose values are the Table objects
+    themselves, so choosing a table is a single dict lookup.
+"""
+import threading
+
+from . import exceptions
+from . import tablestore
+
+
+# age buckets
+AGE_WEEKS = 0           # age <= 3 months and <= 13 weeks
+AGE_UNDER_24 = 1        # age < 24 months
+AGE_24_TO_60 = 2        # 24 <= age <= 60 months
+AGE_60_TO_240 = 3       # 60 < age <= 240 months
+AGE_OVER_240 = 4
+AGE_BUCKETS = range(5)
+
+# height bands
+HEIGHT_UNDER_65 = 0     # height < 65cm
+HEIGHT_65_TO_86 = 1     # 65cm <= height <= 86cm
+HEIGHT_OVER_86 = 2
+HEIGHT_BANDS = range(3)
+
+INDICATORS = ["lhfa", "wfl", "wfh", "wfa", "bmifa", "hcfa"]
+SEXES = ["M", "F"]
+
+
+def age_bucket(age, age_in_weeks):
+    if age <= 3 and age_in_weeks <= 13:
+        return AGE_WEEKS
+    if age < 24:
+        return AGE_UNDER_24
+    if age <= 60:
+        return AGE_24_TO_60
+    if age <= 240:
+        return AGE_60_TO_240
+    return AGE_OVER_240
+
+
+def height_band(height):
+    if height < 65:
+        return HEIGHT_UNDER_65
+    if height <= 86:
+        return HEIGHT_65_TO_86
+    return HEIGHT_OVER_86
+
+
+def table_name(indicator, sex, age, height, american):
+    """ Name of the table for an age bucket and height band. If, for
+    example, the indicator is wfl while the child is too long for the
+    recumbent tables, the wfh table is used. Raises InvalidAge for
+    combinations that cannot be scored. """
+    table_sex = {'M': 'boys', 'F': 'girls'}[sex]
+    if indicator == 'wfl':
+        if height == HEIGHT_OVER_86:
+            # too long for recumbent
+            return 'wfh_%s_2_5' % table_sex
+        return 'wfl_%s_0_2' % table_sex
+    if indicator == 'wfh':
+        if height == HEIGHT_UNDER_65:
+            # too short for standing
+            return 'wfl_%s_0_2' % table_sex
+        return 'wfh_%s_2_5' % table_sex
+
+    if indicator in ["wfa", "lhfa", "hcfa"]:
+        # weight for age has only one table per sex,
+        # as does head circumference for age
+        # and CDC goes unused before 24mos
+        table_age = '0_5'
+        if age == AGE_WEEKS:
+            table_age = '0_13'
+        elif american and age != AGE_UNDER_24:
+            if indicator == "hcfa":
+                raise exceptions.InvalidAge('TOO OLD')
+            table_age = '2_20'
+    else:
+        table_age = {AGE_WEEKS: '0_13',
+                     AGE_UNDER_24: '0_2',
+                     AGE_24_TO_60: '2_5',
+                     AGE_60_TO_240: '2_20'}.get(age)
+        if table_age is None:
+            raise exceptions.InvalidAge('TOO OLD')
+    return '%s_%s_%s' % (indicator, table_sex, table_age)
+
+
+def build_dispatch(american):
+    """ Map every (indicator, sex, age bucket, height band) to a Table,
+    or to the exception raised for it. """
+    tables = tablestore.get_tables(american)
+    dispatch = {}
+    for indicator in INDICATORS:
+        for sex in SEXES:
+            for age in AGE_BUCKETS:
+                for height in HEIGHT_BANDS:
+                    try:
+                        name = table_name(indicator, sex, age, height,
+                                          american)
+                        handle = tables.get(name)
+                        if handle is None:
+                            handle = exceptions.DataNotFound(
+                                'TABLE NOT LOADED: %s' % name)
+                    except exceptions.InvalidAge as e:
+                        handle = e
+                    dispatch[(indicator, sex, age, height, american)] = handle
+    return dispatch
+
+
+_dispatch = {}
+_dispatch_lock = threading.Lock()
+
+
+def get_dispatch():
+    """ Dispatch for both the WHO and the WHO+CDC tables, keyed by
+    (indicator, sex, age bucket, height band, american) """
+    if not _dispatch:
+        with _dispatch_lock:
+            if not _dispatch:
+                dispatch = build_dispatch(False)
+                dispatch.update(build_dispatch(True))
+                _dispatch.update(dispatch)
+    return _dispatch
+
+
+def resolve(indicator, sex, age, height, american):
+    """ Table for an (indicator, sex, age bucket, height band, american)
+    key. Raises InvalidAge or DataNotFound when there is none. """
+    key = (indicator, sex, age, height, american)
+    try:
+        handle = _dispatch[key]
+    except KeyError:
+        handle = get_dispatch().get(key)
+        if handle is None:
+            raise exceptions.DataError('cannot resolve table for: %s, %s'
+                                       % (indicator, sex))
+    if isinstance(handle, Exception):
+        raise type(handle)(*handle.args)
+    return handle
@@ -1,6 +1,29 @@
 import re
 import datetime
 import logging
+import functools
+import collections
+
+import numpy as np
+
+
+# average days per month, as used by date_to_age_in_months
+DAYS_PER_MONTH = 30.4375
+
+ISO_DATE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}$")
+
+# known ways of writing sex, lower-cased and with runs of spaces, dashes,
+# dots, and underscores made single spaces: codes 1/2 (WHO Anthro), M/F,
+# L/P (Indonesian laki-laki/perempuan), and words in English and Indonesian
+SEX_TOKENS = dict(
+    [(token, 'M') for token in [
+        '1', 'm', 'male', 'boy', 'man', 'l', 'lk', 'laki', 'laki laki',
+        'lelaki', 'pria', 'putra', 'cowok']] +
+    [(token, 'F') for token in [
+        '2', 'f', 'female', 'girl', 'woman', 'p', 'pr', 'perempuan',
+        'wanita', 'putri', 'cewek']])
+
+SEX_SEPARATORS = re.compile(r"[\s._-]+")
 
 
 def get_good_date(date, delimiter=False):
@@ -46,10 +69,10 @@ def get_good_date(date, delimiter=False):
         if month.isdigit():
             if int(month) == 2:
                 if int(day) > 28:
-                    day = 28
+                    day = "28"
             if int(month) in [4, 6, 9, 11]:
                 if int(day) > 30:
-                    day = 30
+                    day = "30"
         else:
             return None, None
 
@@ -80,6 +103,97 @@ def get_good_date(date, delimiter=False):
         return good_date_str, good_date_obj
 
 
+def _parse_good_date(value, delimiter=False):
+    # datetime.date (or None) for a single value of get_good_dates
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if value is None:
+        return None
+    date = str(value).strip()
+    try:
+        if ISO_DATE.match(date):
+            year, month, day = date.split('-')
+            return datetime.date(int(year), int(month), int(day))
+        good_date_str, good_date_obj = get_good_date(date, delimiter)
+    except (ValueError, IndexError):
+        return None
+    return good_date_obj
+
+
+def get_good_dates(dates, delimiter=False):
+    """ get_good_date for a whole column of dates. ISO dates (YYYY-MM-DD)
+    and date objects are accepted too. Returns a datetime64[D] array,
+    with NaT for dates that cannot be parsed. """
+    values = np.asarray(dates)
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[D]')
+    # columns of birth and visit dates repeat the same few thousand
+    # dates, so each distinct value is parsed only once
+    uniques = {}
+    codes = [uniques.setdefault(value, len(uniques))
+             for value in values.ravel().tolist()]
+    parsed = np.array([_parse_good_date(value, delimiter)
+                       for value in uniques] or [None],
+                      dtype='datetime64[D]')
+    return parsed[np.array(codes, dtype=np.intp)].reshape(values.shape)
+
+
+def dates_to_ages(birth_dates, measurement_dates=None, delimiter=False):
+    """ Ages in days and in months (as float arrays) of each child on the
+    date it was measured, or today if measurement_dates is None. Dates
+    may be a single date or a column (see get_good_dates). Ages are NaN
+    where a date is missing or the child was measured before birth. """
+    born = get_good_dates(birth_dates, delimiter)
+    if measurement_dates is None:
+        measured = np.datetime64(datetime.date.today(), 'D')
+    else:
+        measured = get_good_dates(measurement_dates, delimiter)
+    delta = measured - born
+    days = np.where(np.isnat(delta), np.nan,
+                    delta.astype(np.int64).astype(np.float64))
+    days[days < 0] = np.nan
+    return days, days / DAYS_PER_MONTH
+
+
+@functools.lru_cache(maxsize=1024)
+def _good_sex_token(value):
+    token = SEX_SEPARATORS.sub(' ', value.strip().lower()).strip()
+    return SEX_TOKENS.get(token)
+
+
+def _good_sex(value):
+    # 'M', 'F', or None for a single value of get_good_sexes
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if value is None:
+        return None
+    return _good_sex_token(str(value))
+
+
+def get_good_sexes(genders):
+    """ Normalize a whole column of sexes to 'M' and 'F' (see SEX_TOKENS).
+    Returns a unicode array with '' for values that are not recognized,
+    and a Counter of those values. Unlike get_good_sex, only whole known
+    tokens are recognized (so 'monkey' is not male). """
+    values = np.asarray(genders, dtype=object)
+    uniques = {}
+    # NaN (as from pandas) is never equal to itself, so memo it as None
+    codes = [uniques.setdefault(value if value == value else None,
+                                len(uniques))
+             for value in values.ravel().tolist()]
+    normalized = [_good_sex(value) for value in uniques]
+    sexes = np.array([sex or '' for sex in normalized] or [''], dtype='<U1')
+    sexes = sexes[np.array(codes, dtype=np.intp)].reshape(values.shape)
+
+    counts = np.bincount(codes, minlength=len(uniques))
+    unmapped = collections.Counter(dict(
+        (value, int(count)) for value, sex, count in
+        zip(uniques, normalized, counts) if sex is None))
+    return sexes, unmapped
+
+
 def get_good_sex(gender):
     # TODO improve patterns so 'monkey' isnt a match for 'male'
     male_pattern = "(m[a-z]*)"
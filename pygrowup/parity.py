@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Parity report of the float64 precision mode against the default
+    Decimal arithmetic, over the survey files bundled in testdata/.
+
+    python -m pygrowup.parity
+"""
+import os
+import csv
+import codecs
+
+from . import pygrowup
+
+
+module_dir = os.path.split(os.path.abspath(__file__))[0]
+
+SURVEY_FILES = ['survey_z_rc.csv', 'survey_z_st.csv']
+
+# survey column holding the measurement for each indicator
+MEASUREMENT_COLUMNS = {'lhfa': 'HEIGHT', 'wfl': 'WEIGHT', 'wfh': 'WEIGHT',
+                       'wfa': 'WEIGHT', 'bmifa': '_CBMI', 'hcfa': 'HEAD'}
+
+
+def open_survey(file_name):
+    """ A survey file from testdata/, opened as text """
+    return codecs.open(os.path.join(module_dir, 'testdata', file_name), 'r',
+                       encoding='utf-8', errors='ignore')
+
+
+def read_survey(file_name):
+    """ Rows of a survey file from testdata/ as dicts, with GENDER
+    translated from 1/2 to M/F """
+    with open_survey(file_name) as f:
+        rows = list(csv.DictReader(f, dialect='excel'))
+    for row in rows:
+        row['GENDER'] = {'1': 'M', '2': 'F'}.get(row['GENDER'])
+    return rows
+
+
+def _zscore(calc, indicator, row):
+    try:
+        return calc.zscore_for_measurement(
+            indicator, row[MEASUREMENT_COLUMNS[indicator]], row['agemons'],
+            row['GENDER'], row['HEIGHT'])
+    except (AssertionError, RuntimeError, ValueError):
+        return None
+
+
+def parity_report(file_names=SURVEY_FILES, adjust_weight_scores=False):
+    """ Compare float and decimal z-scores for every row and indicator.
+
+    Returns a dict keyed by indicator with the number of rows scored,
+    the maximum absolute difference, the number of rows whose scores
+    differ, and the number of rows scored by only one of the modes. """
+    decimal_calc = pygrowup.Calculator(
+        include_cdc=True, adjust_weight_scores=adjust_weight_scores)
+    float_calc = pygrowup.Calculator(
+        include_cdc=True, adjust_weight_scores=adjust_weight_scores,
+        precision="float")
+    report = dict((indicator, {'rows': 0, 'max_abs_diff': 0.0,
+                               'differ': 0, 'unmatched': 0})
+                  for indicator in MEASUREMENT_COLUMNS)
+    for file_name in file_names:
+        for row in read_survey(file_name):
+            for indicator, result in report.items():
+                exact = _zscore(decimal_calc, indicator, row)
+                fast = _zscore(float_calc, indicator, row)
+                if exact is None and fast is None:
+                    continue
+                if exact is None or fast is None:
+                    result['unmatched'] += 1
+                    continue
+                result['rows'] += 1
+                diff = abs(float(exact) - fast)
+                if diff:
+                    result['differ'] += 1
+                result['max_abs_diff'] = max(result['max_abs_diff'], diff)
+    return report
+
+
+if __name__ == '__main__':
+    for adjust in [False, True]:
+        print('adjust_weight_scores=%s' % adjust)
+        print('%-8s %6s %12s %6s %9s' % ('', 'rows', 'max abs diff',
+                                         'differ', 'unmatched'))
+        for indicator, r in sorted(parity_report(
+                adjust_weight_scores=adjust).items()):
+            print('%-8s %6d %12.2f %6d %9d' % (
+                indicator, r['rows'], r['max_abs_diff'], r['differ'],
+                r['unmatched']))
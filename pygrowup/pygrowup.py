@@ -1,19 +1,18 @@
 #!/usr/bin/env python
 # vim: ai ts=4 sts=4 et sw=4
-import os
 import math
 import decimal
 import logging
-import json
 from decimal import Decimal as D
 
 import six
 
+from . import dispatch
 from . import exceptions
+from . import tablestore
 
 
-# TODO is this the best way to get this file's directory?
-module_dir = os.path.split(os.path.abspath(__file__))[0]
+INDICATORS = ["wfa", "lhfa", "wfl", "wfh", "bmifa", "hcfa"]
 
 
 class Observation(object):
@@ -25,13 +24,13 @@ class Observation(object):
         self.measurement = measurement
         self.position = None
         self.age = D(age_in_months)
+        # float age (in months and weeks) used to find tables and rows
+        self.age_months = float(self.age)
+        self.age_weeks = self.age_months * 30.4374 / 7
         self.sex = sex.upper()
         self.height = height
         self.american = american
 
-        self.table_indicator = None
-        self.table_age = None
-        self.table_sex = None
         if self.indicator in ['wfl', 'wfh']:
             if self.height in ['', ' ', None]:
                 raise exceptions.InvalidMeasurement('no length or height')
@@ -57,148 +56,96 @@ class Observation(object):
         # otherwise return with decimal places
         return rounded.to_eng_string()
 
-    def get_zscores(self, growth):
-        table_name = self.resolve_table()
-        table = getattr(growth, table_name)
-        if self.indicator in ["wfh", "wfl"]:
-            assert self.height is not None
-            if D(self.height) < D(45):
+    @property
+    def closest_height(self):
+        """ Height rounded to the closest half centimeter -- the
+            resolution of the WHO tables -- as a float.
+        """
+        height = float(self.height)
+        correction = 0.5 if height >= 0 else -0.5
+        return int(height / 0.5 + correction) * 0.5
+
+    def lookup(self, growth, indicator=None):
+        """ Find the table and the row within it for this observation
+        (or for another indicator measured at the same age and height).
+        Rows are located arithmetically from the height or age (see
+        tablestore.Table.index), so returns a (table, row index) tuple.
+        Tables come from the shared registry used by every Calculator
+        (growth), so growth is only kept for backwards compatibility.
+        """
+        indicator = indicator or self.indicator
+        # resolve needs the height to choose a wfl/wfh table
+        if indicator in ["wfh", "wfl"] and self.height in ['', ' ', None]:
+            raise exceptions.InvalidMeasurement('no length or height')
+        table = self.resolve(indicator)
+        if indicator in ["wfh", "wfl"]:
+            height = float(self.height)
+            if height < 45:
                 raise exceptions.InvalidMeasurement("too short")
-            if D(self.height) > D(120):
+            if height > 120:
                 raise exceptions.InvalidMeasurement("too tall")
-            # find closest height from WHO table (which has data at a resolution
-            # of half a centimeter).
-            # round height to closest tenth of a centimeter
-            # NOTE heights in tables are EITHER ints or floats!
-            # (e.g., 60, 60.5)
-            closest_height = self.rounded_height
+            # find closest height from WHO table (which has data at a
+            # resolution of half a centimeter).
+            closest_height = self.closest_height
             self.logger.debug("looking up scores with: %s" % closest_height)
-            scores = table.get(closest_height)
-            if scores is not None:
-                return scores
+            index = table.index(closest_height)
+            if index is not None:
+                return table, index
             raise exceptions.DataNotFound("SCORES NOT FOUND BY HEIGHT: %s => "
                                           "%s" % (self.height, closest_height))
 
-        elif self.indicator in ["lhfa", "wfa", "bmifa", "hcfa"]:
-            if self.age_in_weeks <= D(13):
-                closest_week = str(int(math.floor(self.age_in_weeks)))
-                scores = table.get(closest_week)
-                if scores is not None:
-                    return scores
+        elif indicator in ["lhfa", "wfa", "bmifa", "hcfa"]:
+            if self.age_weeks <= 13:
+                closest_week = int(math.floor(self.age_weeks))
+                index = table.index(closest_week)
+                if index is not None:
+                    return table, index
                 raise exceptions.DataNotFound("SCORES NOT FOUND BY WEEK: %s => "
                                               " %s" % (str(self.age_in_weeks),
                                                        closest_week))
-            closest_month = str(int(math.floor(self.age)))
-            scores = table.get(closest_month)
-            if scores is not None:
-                return scores
+            closest_month = int(math.floor(self.age_months))
+            index = table.index(closest_month)
+            if index is not None:
+                return table, index
             raise exceptions.DataNotFound("SCORES NOT FOUND BY MONTH: %s =>"
                                           " %s" % (str(self.age),
                                                    closest_month))
 
-    def resolve_table(self):
+    def get_zscores(self, growth):
+        """ Row of the resolved table as a dict (e.g., {'L': ..., 'M': ...,
+        'S': ..., 'SD2': ...}) """
+        table, index = self.lookup(growth)
+        return table.row(index)
+
+    def resolve(self, indicator=None):
         """ Choose a WHO/CDC table to use, making adjustments
         based on age, length, or height. If, for example, the
         indicator is set to wfl while the child is too long for
         the recumbent tables, this method will make the lookup
-        in the wfh table. """
-        if self.indicator == 'wfl' and D(self.height) > D(86):
-            self.logger.warning('too long for recumbent')
-            self.table_indicator = 'wfh'
-            self.table_age = '2_5'
-        elif self.indicator == 'wfh' and D(self.height) < D(65):
-            self.logger.warning('too short for standing')
-            self.table_indicator = 'wfl'
-            self.table_age = '0_2'
-        else:
-            self.table_indicator = self.indicator
-            if self.table_indicator == 'wfl':
-                self.table_age = '0_2'
-            if self.table_indicator == 'wfh':
-                self.table_age = '2_5'
-
-        if self.sex == 'M':
-            self.table_sex = 'boys'
-        if self.sex == 'F':
-            self.table_sex = 'girls'
-
-        # weight for age has only one table per sex,
-        # as does head circumference for age
-        # and CDC goes unused before 24mos
-        if self.indicator in ["wfa", "lhfa", "hcfa"]:
-            self.table_age = "0_5"
-            if self.age <= D(3):
-                if self.age_in_weeks <= D(13):
-                    self.table_age = "0_13"
-            if self.american and self.age >= D(24):
-                if self.indicator == "hcfa":
-                    raise exceptions.InvalidAge('TOO OLD: %d' % self.age)
-                self.table_age = "2_20"
-        elif self.indicator in ["bmifa"]:
-            if self.age > D(240):
-                raise exceptions.InvalidAge('TOO OLD: %d' % self.age)
-            elif self.age <= D(3) and self.age_in_weeks <= D(13):
-                self.table_age = "0_13"
-            elif self.age < D(24):
-                self.table_age = '0_2'
-            elif self.age >= D(24) and self.age <= D(60):
-                self.table_age = '2_5'
-            elif self.age >= D(24) and self.age > D(60):
-                self.table_age = '2_20'
-            else:
-                raise exceptions.DataNotFound()
+        in the wfh table. The choice for every combination of
+        cutoffs is precomputed (see dispatch.py). """
+        indicator = indicator or self.indicator
+        if indicator in ["wfl", "wfh"]:
+            age_bucket = dispatch.AGE_WEEKS
+            height_band = dispatch.height_band(float(self.height))
         else:
-            if self.table_age is None:
-                if self.table_indicator == 'wfl':
-                    self.table_age = '0_2'
-                if self.table_indicator == 'wfh':
-                    self.table_age = '2_5'
-                if self.age < D(24):
-                    if self.table_indicator == 'wfh':
-                        self.logger.warning('too young for standing')
-                        self.table_indicator == 'wfl'
-                    self.table_age = '0_2'
-                elif self.age >= D(24):
-                    if self.table_indicator == 'wfl':
-                        self.logger.warning('too old for recumbent')
-                        self.table_indicator == 'wfh'
-                    self.table_age = '2_5'
-                else:
-                    raise exceptions.DataNotFound()
-        table = "%(table_indicator)s_%(table_sex)s_%(table_age)s" %\
-                {"table_indicator": self.table_indicator,
-                 "table_sex": self.table_sex,
-                 "table_age": self.table_age}
-        self.logger.debug(table)
-        # raise if any table name parts have not been resolved
-        if not all([self.table_indicator, self.table_sex, self.table_age]):
-            raise exceptions.DataError()
-        return table
+            age_bucket = dispatch.age_bucket(self.age_months, self.age_weeks)
+            height_band = dispatch.HEIGHT_UNDER_65
+        return dispatch.resolve(indicator, self.sex, age_bucket,
+                                height_band, bool(self.american))
 
+    def resolve_table(self):
+        """ Name of the table chosen by resolve """
+        table = self.resolve()
+        self.logger.debug(table.name)
+        return table.name
 
-class Calculator(object):
 
-    def __reformat_table(self, table_name):
-        """ Reformat list of dicts to single dict
-        with each item keyed by age, length, or height."""
-        list_of_dicts = getattr(self, table_name)
-        if 'Length' in list_of_dicts[0]:
-            field_name = 'Length'
-        elif 'Height' in list_of_dicts[0]:
-            field_name = 'Height'
-        elif 'Month' in list_of_dicts[0]:
-            field_name = 'Month'
-        elif 'Week' in list_of_dicts[0]:
-            field_name = 'Week'
-        else:
-            raise exceptions.DataError('error loading: %s' % table_name)
-        new_dict = {'field_name': field_name}
-        for d in list_of_dicts:
-            new_dict.update({d[field_name]: d})
-        setattr(self, table_name, new_dict)
+class Calculator(object):
 
     def __init__(self, adjust_height_data=False, adjust_weight_scores=False,
-                 include_cdc=False, logger_name='pygrowup', log_level="INFO"):
+                 include_cdc=False, logger_name='pygrowup', log_level="INFO",
+                 precision="decimal"):
         self.logger = logging.getLogger(logger_name)
         self.logger.setLevel(getattr(logging, log_level))
 
@@ -229,52 +176,23 @@ class Calculator(object):
 
         self.include_cdc = include_cdc
 
-        # load WHO Growth Standards
-        # http://www.who.int/childgrowth/standards/en/
-        # WHO tab-separated txt files have been converted to json,
-        # and the seperate lhfa tables (0-2 and 2-5) have been combined
-
-        WHO_tables = [
-            'wfl_boys_0_2_zscores.json',  'wfl_girls_0_2_zscores.json',
-            'wfh_boys_2_5_zscores.json',  'wfh_girls_2_5_zscores.json',
-            'lhfa_boys_0_5_zscores.json', 'lhfa_girls_0_5_zscores.json',
-            'hcfa_boys_0_5_zscores.json', 'hcfa_girls_0_5_zscores.json',
-            'wfa_boys_0_5_zscores.json',  'wfa_girls_0_5_zscores.json',
-            'wfa_boys_0_13_zscores.json',  'wfa_girls_0_13_zscores.json',
-            'lhfa_boys_0_13_zscores.json', 'lhfa_girls_0_13_zscores.json',
-            'hcfa_boys_0_13_zscores.json', 'hcfa_girls_0_13_zscores.json',
-            'bmifa_boys_0_13_zscores.json', 'bmifa_girls_0_13_zscores.json',
-            'bmifa_boys_0_2_zscores.json',  'bmifa_girls_0_2_zscores.json',
-            'bmifa_boys_2_5_zscores.json',  'bmifa_girls_2_5_zscores.json']
-
-        # load CDC growth standards
-        # http://www.cdc.gov/growthcharts/
-        # CDC csv files have been converted to JSON, and the third standard
-        # deviation has been fudged for the purpose of this tool.
-
-        CDC_tables = [
-            'lhfa_boys_2_20_zscores.cdc.json',
-            'lhfa_girls_2_20_zscores.cdc.json',
-            'wfa_boys_2_20_zscores.cdc.json',
-            'wfa_girls_2_20_zscores.cdc.json',
-            'bmifa_boys_2_20_zscores.cdc.json',
-            'bmifa_girls_2_20_zscores.cdc.json', ]
-
-        # TODO is this the best way to find the tables?
-        table_dir = os.path.join(module_dir, 'tables')
-        tables_to_load = WHO_tables
-        if self.include_cdc:
-            tables_to_load = tables_to_load + CDC_tables
-        for table in tables_to_load:
-            table_file = os.path.join(table_dir, table)
-            with open(table_file, 'r') as f:
-                # drop _zscores.json from table name and use
-                # result as attribute name
-                # (e.g., wfa_boys_0_5_zscores.json => wfa_boys_0_5)
-                table_name, underscore, zscore_part =\
-                    table.split('.')[0].rpartition('_')
-                setattr(self, table_name, json.load(f))
-                self.__reformat_table(table_name)
+        # "decimal" (the default) calculates z-scores with decimal.Decimal
+        # as described above. "float" uses float64 arithmetic instead,
+        # which is several times faster and agrees with the decimal results
+        # to within rounding of the hundredth (see parity.py). z-scores
+        # are then returned as floats rather than Decimals.
+        assert precision in ["decimal", "float"]
+        self.precision = precision
+
+        # WHO Growth Standards (and CDC growth standards if include_cdc),
+        # loaded once per process and shared by all Calculators
+        # (see tablestore)
+        self.tables = tablestore.get_tables(self.include_cdc)
+        for table_name, table in self.tables.items():
+            # tables are also available as attributes named after the table
+            # file without _zscores.json
+            # (e.g., wfa_boys_0_5_zscores.json => wfa_boys_0_5)
+            setattr(self, table_name, table)
 
     # convenience methods
     def lhfa(self, measurement=None, age_in_months=None, sex=None, height=None):
@@ -313,6 +231,73 @@ class Calculator(object):
                                            age_in_months=age_in_months,
                                            sex=sex, height=height)
 
+    def all_indicators(self, weight, height, age_in_months, sex,
+                       head_circumference=None):
+        """ Calculate every indicator that applies to one child at once.
+
+        Age, sex, and height are parsed (and BMI calculated) only once.
+        Returns a dict keyed by indicator, with None for indicators that
+        do not apply or cannot be calculated: wfl is used under 24 months
+        and wfh from 24 months, and hcfa needs a head circumference. """
+        assert sex is not None
+        assert isinstance(sex, six.string_types)
+        assert sex.upper() in ["M", "F"]
+        assert age_in_months is not None
+
+        obs = Observation(None, None, age_in_months, sex, height,
+                          self.include_cdc, self.logger.name)
+        number = float if self.precision == "float" else D
+        blank = ['', ' ', None]
+        weight = None if weight in blank else number(weight)
+        length = None if height in blank else number(height)
+        measurements = {'wfa': weight, 'lhfa': length,
+                        'hcfa': head_circumference}
+        if obs.age_months < 24:
+            measurements['wfl'] = weight
+        else:
+            measurements['wfh'] = weight
+        if weight is not None and length:
+            measurements['bmifa'] = weight / (length / 100) ** 2
+
+        results = {}
+        for indicator in INDICATORS:
+            measurement = measurements.get(indicator)
+            results[indicator] = None
+            if measurement in blank:
+                continue
+            try:
+                results[indicator] = self._zscore_for_observation(
+                    indicator, measurement, obs)
+            except (RuntimeError, ArithmeticError, ValueError) as e:
+                self.logger.debug("%s: %s" % (indicator, e))
+        return results
+
+    def all_indicators_batch(self, weights, heights, ages, sexes,
+                             head_circumferences=None, indicators=None,
+                             flags=False):
+        """ all_indicators for whole columns of children at once (see
+        zscores_batch). Returns a dict of float64 arrays keyed by
+        indicator, with NaN where an indicator does not apply. Pass
+        indicators to calculate only some of them, and flags to also
+        flag implausible z-scores (see vectorized.flag_zscores). """
+        from . import vectorized
+        return vectorized.all_indicators_batch(self, weights, heights, ages,
+                                               sexes, head_circumferences,
+                                               indicators, flags)
+
+    def zscores_batch(self, indicator, measurements, ages, sexes, heights=None):
+        """ Calculate z-scores for whole columns of observations at once.
+
+        Takes NumPy arrays or sequences (of equal length, or scalars to be
+        broadcast) and returns a float64 array of z-scores rounded to the
+        hundredth, matching zscore_for_measurement row for row. Rows that
+        zscore_for_measurement would reject are returned as NaN. """
+        # numpy is only needed for batches, so keep it out of the import
+        # path of the scalar API
+        from . import vectorized
+        return vectorized.zscores_batch(self, indicator, measurements, ages,
+                                        sexes, heights)
+
     def zscore_for_measurement(self, indicator, measurement, age_in_months, sex, height=None):
         assert sex is not None
         assert isinstance(sex, six.string_types)
@@ -323,6 +308,15 @@ class Calculator(object):
         # reject blank measurements
         assert measurement not in ['', ' ', None]
 
+        obs = Observation(indicator, measurement, age_in_months, sex, height,
+                          self.include_cdc, self.logger.name)
+        return self._zscore_for_observation(indicator, measurement, obs)
+
+    def _zscore_for_observation(self, indicator, measurement, obs):
+        if self.precision == "float":
+            return self._float_zscore_for_observation(indicator, measurement,
+                                                      obs)
+
         # this is our length or height or weight or bmi measurement.
         # allow exception if measurement cannot be cast as Decimal
         y = D(measurement)
@@ -333,9 +327,6 @@ class Calculator(object):
                                                 ' than zero')
         self.logger.debug("MEASUREMENT: %d" % y)
 
-        obs = Observation(indicator, measurement, age_in_months, sex, height,
-                          self.include_cdc, self.logger.name)
-
         # indicator-specific methodology
         # (see section 5.1 of http://www.who.int/entity/childgrowth/standards/\
         #                                  technical_report/en/index.html)
@@ -354,21 +345,18 @@ class Calculator(object):
             # (basically to convert all height measurments to lengths)
             y = y + D('0.7')
 
-        # get zscore from appropriate table
-        zscores = obs.get_zscores(self)
-
-        if zscores is None:
-            raise exceptions.DataNotFound()
+        # get row of appropriate table
+        table, index = obs.lookup(self, indicator)
 
-        # fetch necessary scores from zscores dict and cast as decimals
+        # fetch necessary scores from table row and cast as decimals
         # L(t)
-        box_cox_power = D(zscores.get("L"))
+        box_cox_power = D(table.L[index])
         self.logger.debug("BOX-COX: %d" % box_cox_power)
         # M(t)
-        median_for_age = D(zscores.get("M"))
+        median_for_age = D(table.M[index])
         self.logger.debug("MEDIAN: %d" % median_for_age)
         # S(t)
-        coefficient_of_variance_for_age = D(zscores.get("S"))
+        coefficient_of_variance_for_age = D(table.S[index])
         self.logger.debug("COEF VAR: %d" % coefficient_of_variance_for_age)
 
         ###
@@ -442,33 +430,14 @@ class Calculator(object):
                 #           |          SD23neg
                 #           |
                 #           |_
-                def calc_stdev(sd):
-                    #   e.g.,
-                    #
-                    #   SD3neg = M(t)[1 + L(t) * S(t) * (-3)]^ 1/L(t)
-                    #   SD2pos = M(t)[1 + L(t) * S(t) * (2)]^ 1/L(t)
-                    #
-                    ###
-                    base = self.context.add(D(1), self.context.multiply(
-                        self.context.multiply(box_cox_power,
-                                              coefficient_of_variance_for_age), D(sd)))
-                    exponent = self.context.divide(D(1), box_cox_power)
-                    power = math.pow(base, exponent)
-                    stdev = self.context.multiply(median_for_age, D(str(power)))
-                    return D(stdev)
+                # cutoffs are calculated once per table
+                # (see tablestore.Table.cutoffs)
+                cutoffs = table.cutoffs()
 
                 if (zscore > D(3)):
                     logging.info("Z greater than 3")
-                    # TODO measure performance of lookup vs calculation
-                    # calculate for now so we have greater precision
-
-                    # get cutoffs from z-scores dict
-                    # SD2pos = D(zscores.get("SD2"))
-                    # SD3pos = D(zscores.get("SD3"))
-
-                    # calculate SD
-                    SD2pos_c = calc_stdev(2)
-                    SD3pos_c = calc_stdev(3)
+                    SD2pos_c = D(cutoffs[2][index])
+                    SD3pos_c = D(cutoffs[3][index])
 
                     # compute distance
                     SD23pos_c = SD3pos_c - SD2pos_c
@@ -481,13 +450,8 @@ class Calculator(object):
                     return zscore.quantize(D('.01'))
 
                 if (zscore < D(-3)):
-                    # get cutoffs from z-scores dict
-                    # SD2neg = D(zscores.get("SD2neg"))
-                    # SD3neg = D(zscores.get("SD3neg"))
-
-                    # calculate SD
-                    SD2neg_c = calc_stdev(-2)
-                    SD3neg_c = calc_stdev(-3)
+                    SD2neg_c = D(cutoffs[-2][index])
+                    SD3neg_c = D(cutoffs[-3][index])
 
                     # compute distance
                     SD23neg_c = SD2neg_c - SD3neg_c
@@ -498,3 +462,42 @@ class Calculator(object):
                     div = self.context.divide(sub, SD23neg_c)
                     zscore = self.context.add(D(-3), div)
                     return zscore.quantize(D('.01'))
+
+    def _float_zscore_for_observation(self, indicator, measurement, obs):
+        """ zscore_for_measurement using float64 arithmetic throughout
+        (see precision in __init__ and comments in zscore_for_measurement)
+        """
+        y = float(measurement)
+        if y <= 0:
+            raise exceptions.InvalidMeasurement('measurement must be greater'
+                                                ' than zero')
+
+        if indicator == "wfl":
+            if 65.7 < y < 120.7:
+                y = y - 0.7
+        if indicator == "wfh" and self.adjust_height_data:
+            y = y + 0.7
+
+        table, index = obs.lookup(self, indicator)
+        box_cox_power = table.L[index]
+        median_for_age = table.M[index]
+        coefficient_of_variance_for_age = table.S[index]
+
+        zscore = (((y / median_for_age) ** box_cox_power - 1) /
+                  (coefficient_of_variance_for_age * box_cox_power))
+
+        if (self.adjust_weight_scores and indicator in ["wfl", "wfh", "wfa"]
+                and abs(zscore) > 3):
+            # restricted application of LMS method
+            cutoffs = table.cutoffs()
+            if zscore > 3:
+                SD2pos = cutoffs[2][index]
+                SD3pos = cutoffs[3][index]
+                zscore = 3 + (y - SD3pos) / (SD3pos - SD2pos)
+            else:
+                SD2neg = cutoffs[-2][index]
+                SD3neg = cutoffs[-3][index]
+                zscore = -3 + (y - SD3neg) / (SD2neg - SD3neg)
+
+        # round to hundreth and return
+        return round(zscore, 2)
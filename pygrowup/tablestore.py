@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Loading of the WHO/CDC growth tables.
+
+    The tables ship as JSON (converted from the WHO/CDC source files), but
+    parsing 1.3 MB of string-valued JSON dominates the start-up time of a
+    Calculator. `python -m pygrowup.tablestore` compiles all of the JSON
+    tables into a single binary file of float64 columns, which is then
+    memory-mapped at load time. The JSON tables are still used for any
+    table missing from the compiled file (or if the file itself is
+    missing).
+
+    Compiled file layout (all integers and floats little-endian):
+
+        8 bytes     magic (b'PYGROWUP')
+        uint32      format version
+        uint32      length of the JSON header in bytes
+        ...         JSON header, padded with spaces to a multiple of 8
+        ...         float64 column data
+"""
+import os
+import sys
+import math
+import mmap
+import json
+import struct
+import hashlib
+import logging
+import threading
+from array import array
+
+from . import exceptions
+
+
+# TODO is this the best way to get this file's directory?
+module_dir = os.path.split(os.path.abspath(__file__))[0]
+table_dir = os.path.join(module_dir, 'tables')
+
+COMPILED_TABLES = os.path.join(table_dir, 'zscores.bin')
+MAGIC = b'PYGROWUP'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+
+# load WHO Growth Standards
+# http://www.who.int/childgrowth/standards/en/
+# WHO tab-separated txt files have been converted to json,
+# and the seperate lhfa tables (0-2 and 2-5) have been combined
+WHO_TABLES = [
+    'wfl_boys_0_2_zscores.json',  'wfl_girls_0_2_zscores.json',
+    'wfh_boys_2_5_zscores.json',  'wfh_girls_2_5_zscores.json',
+    'lhfa_boys_0_5_zscores.json', 'lhfa_girls_0_5_zscores.json',
+    'hcfa_boys_0_5_zscores.json', 'hcfa_girls_0_5_zscores.json',
+    'wfa_boys_0_5_zscores.json',  'wfa_girls_0_5_zscores.json',
+    'wfa_boys_0_13_zscores.json',  'wfa_girls_0_13_zscores.json',
+    'lhfa_boys_0_13_zscores.json', 'lhfa_girls_0_13_zscores.json',
+    'hcfa_boys_0_13_zscores.json', 'hcfa_girls_0_13_zscores.json',
+    'bmifa_boys_0_13_zscores.json', 'bmifa_girls_0_13_zscores.json',
+    'bmifa_boys_0_2_zscores.json',  'bmifa_girls_0_2_zscores.json',
+    'bmifa_boys_2_5_zscores.json',  'bmifa_girls_2_5_zscores.json']
+
+# load CDC growth standards
+# http://www.cdc.gov/growthcharts/
+# CDC csv files have been converted to JSON, and the third standard
+# deviation has been fudged for the purpose of this tool.
+CDC_TABLES = [
+    'lhfa_boys_2_20_zscores.cdc.json',
+    'lhfa_girls_2_20_zscores.cdc.json',
+    'wfa_boys_2_20_zscores.cdc.json',
+    'wfa_girls_2_20_zscores.cdc.json',
+    'bmifa_boys_2_20_zscores.cdc.json',
+    'bmifa_girls_2_20_zscores.cdc.json', ]
+
+KEY_FIELDS = ['Length', 'Height', 'Month', 'Week']
+
+# SDs of the reference curves drawn on growth charts (see Table.curves)
+SD_CURVES = (-3, -2, -1, 0, 1, 2, 3)
+
+
+def sd_value(sd, L, M, S):
+    """ Measurement at sd standard deviations from the median (the LMS
+    method), or NaN where the curve is undefined """
+    base = 1 + L * S * sd
+    if base <= 0:
+        return float('nan')
+    return M * math.pow(base, 1 / L)
+
+
+def table_name_for(table_file):
+    """ drop _zscores.json from table file name and use result
+    as table name (e.g., wfa_boys_0_5_zscores.json => wfa_boys_0_5) """
+    table_name, underscore, zscore_part =\
+        table_file.split('.')[0].rpartition('_')
+    return table_name
+
+
+class Table(object):
+    """ A single growth table, stored as one float column per value
+    (L, M, S, SD3neg, ...) with rows at evenly spaced keys starting
+    at first_key (e.g., every half centimeter from 45cm), so that the
+    row for a height or age is found arithmetically. """
+
+    def __init__(self, name, field_name, first_key, step, columns):
+        self.name = name
+        self.field_name = field_name
+        self.first_key = first_key
+        self.step = step
+        # column name => array('d') or memoryview of float64
+        self.columns = columns
+        self.L = columns['L']
+        self.M = columns['M']
+        self.S = columns['S']
+        self.size = len(self.L)
+        self._cutoffs = None
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return '<Table %s: %d rows by %s>' % (self.name, self.size,
+                                               self.field_name)
+
+    @property
+    def nbytes(self):
+        return sum(len(column) * 8 for column in self.columns.values())
+
+    def index(self, key):
+        """ Row index for a key (length or height in cm, or age in weeks
+        or months), or None if the table has no row for it. """
+        index = (key - self.first_key) / self.step
+        if index != int(index) or not 0 <= index < self.size:
+            return None
+        return int(index)
+
+    def cutoffs(self):
+        """ Columns of the z-score cutoffs used by the restricted LMS method
+        (see Calculator.zscore_for_measurement), keyed by SD (-3, -2, 2, 3)
+
+            SD3neg = M(t)[1 + L(t) * S(t) * (-3)]^ 1/L(t)
+            SD2pos = M(t)[1 + L(t) * S(t) * (2)]^ 1/L(t)
+
+        These are calculated rather than read from the SD columns of the
+        table for greater precision, once per table on first use. """
+        if self._cutoffs is None:
+            self._cutoffs = dict(
+                (sd, memoryview(array('d', [
+                    sd_value(sd, self.L[i], self.M[i], self.S[i])
+                    for i in range(self.size)])).toreadonly())
+                for sd in (-3, -2, 2, 3))
+        return self._cutoffs
+
+    def keys(self):
+        """ Key of every row (e.g., age in months) """
+        return [self.first_key + i * self.step for i in range(self.size)]
+
+    def curves(self, sds=SD_CURVES):
+        """ Measurement at each SD in sds for every row, keyed by SD, as
+        drawn on growth charts """
+        return dict((sd, [sd_value(sd, self.L[i], self.M[i], self.S[i])
+                          for i in range(self.size)])
+                    for sd in sds)
+
+    def row(self, index):
+        return dict((name, column[index])
+                    for name, column in self.columns.items())
+
+    def get(self, key, default=None):
+        """ Look up a row by its key (e.g., '60.5' or '24') """
+        index = self.index(float(key))
+        if index is None:
+            return default
+        return self.row(index)
+
+
+class TableStore(object):
+    """ A set of Tables keyed by table name (e.g., wfa_boys_0_5) """
+
+    def __init__(self, tables):
+        self._tables = dict(tables)
+        self._digest = None
+
+    def __getitem__(self, table_name):
+        return self._tables[table_name]
+
+    def __contains__(self, table_name):
+        return table_name in self._tables
+
+    def __iter__(self):
+        return iter(self._tables)
+
+    def __len__(self):
+        return len(self._tables)
+
+    def get(self, table_name, default=None):
+        return self._tables.get(table_name, default)
+
+    def items(self):
+        return self._tables.items()
+
+    @property
+    def nbytes(self):
+        return sum(t.nbytes for t in self._tables.values())
+
+    def digest(self):
+        """ SHA-1 (hex) of the keys and column data of every table, the
+        same whether the tables were loaded from JSON or compiled, and
+        different whenever any value changes """
+        if self._digest is None:
+            sha1 = hashlib.sha1()
+            for name in sorted(self._tables):
+                table = self._tables[name]
+                sha1.update(('%s %s %r %r %d\n' % (
+                    name, table.field_name, table.first_key, table.step,
+                    table.size)).encode('utf-8'))
+                for column_name in sorted(table.columns):
+                    sha1.update(column_name.encode('utf-8'))
+                    sha1.update(array('d', table.columns[column_name]))
+            self._digest = sha1.hexdigest()
+        return self._digest
+
+
+def load_json_table(table_file):
+    """ Load a table from one of the JSON files in tables/ """
+    table_name = table_name_for(os.path.basename(table_file))
+    with open(table_file, 'r') as f:
+        list_of_dicts = json.load(f)
+    for field_name in KEY_FIELDS:
+        if field_name in list_of_dicts[0]:
+            break
+    else:
+        raise exceptions.DataError('error loading: %s' % table_name)
+
+    # later rows win when a key is repeated
+    # (e.g., month 24 of the combined lhfa tables)
+    rows = dict((float(d[field_name]), d) for d in list_of_dicts)
+    keys = sorted(rows)
+    first_key = keys[0]
+    step = keys[1] - keys[0]
+    for i, key in enumerate(keys):
+        if key != first_key + i * step:
+            raise exceptions.DataError('missing rows in: %s' % table_name)
+
+    column_names = [k for k in list_of_dicts[0] if k != field_name]
+    columns = dict((name, memoryview(array('d', [float(rows[k][name])
+                                                 for k in keys])).toreadonly())
+                   for name in column_names)
+    return Table(table_name, field_name, first_key, step, columns)
+
+
+def compile_tables(table_files=None, output=COMPILED_TABLES):
+    """ Compile JSON tables into a single binary file of float64
+    columns (see module docstring for the layout). """
+    if table_files is None:
+        table_files = WHO_TABLES + CDC_TABLES
+    tables = [load_json_table(os.path.join(table_dir, t))
+              for t in table_files]
+
+    header = {}
+    data = array('d')
+    for table in tables:
+        offsets = {}
+        for name in sorted(table.columns):
+            offsets[name] = len(data)
+            data.extend(table.columns[name])
+        header[table.name] = {'field_name': table.field_name,
+                              'first_key': table.first_key,
+                              'step': table.step,
+                              'rows': table.size,
+                              'columns': offsets}
+    header = json.dumps({'tables': header}, sort_keys=True).encode('utf-8')
+    header += b' ' * (-(PREAMBLE.size + len(header)) % 8)
+    if sys.byteorder != 'little':
+        data.byteswap()
+
+    with open(output, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(data.tobytes())
+    return output
+
+
+def load_compiled(path=COMPILED_TABLES):
+    """ Memory-map a compiled table file and return a dict of Tables
+    whose columns are views into the mapping. """
+    with open(path, 'rb') as f:
+        magic, version, header_length = PREAMBLE.unpack(
+            f.read(PREAMBLE.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise exceptions.DataError('not a compiled table file: %s' % path)
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data_start = PREAMBLE.size + header_length
+    if sys.byteorder == 'little':
+        data = memoryview(buf)[data_start:].cast('d')
+    else:
+        data = array('d', buf[data_start:])
+        data.byteswap()
+
+    tables = {}
+    for table_name, spec in header['tables'].items():
+        size = spec['rows']
+        columns = dict((name, data[offset:offset + size])
+                       for name, offset in spec['columns'].items())
+        tables[table_name] = Table(table_name, spec['field_name'],
+                                   spec['first_key'], spec['step'], columns)
+    return tables
+
+
+def load_tables(table_files, compiled=COMPILED_TABLES):
+    """ Load tables by file name into a TableStore, preferring the
+    compiled binary file and falling back to JSON for anything it
+    does not contain. """
+    tables = {}
+    if compiled and os.path.exists(compiled):
+        try:
+            tables = load_compiled(compiled)
+        except (exceptions.DataError, ValueError, struct.error) as e:
+            logging.getLogger('pygrowup').warning(
+                'ignoring compiled tables: %s' % e)
+    loaded = {}
+    for table_file in table_files:
+        table_name = table_name_for(table_file)
+        if table_name not in tables:
+            tables[table_name] = load_json_table(
+                os.path.join(table_dir, table_file))
+        loaded[table_name] = tables[table_name]
+    return TableStore(loaded)
+
+
+# process-wide registry of loaded tables, shared by every Calculator.
+# Tables are read-only once loaded, so the same TableStore can safely be
+# used from any number of threads.
+_registry = {}
+_registry_lock = threading.Lock()
+_registry_stats = {'loads': 0}
+
+
+def get_tables(include_cdc=False):
+    """ Shared TableStore of the WHO tables (and CDC tables if include_cdc),
+    loaded once per process. """
+    store = _registry.get(include_cdc)
+    if store is None:
+        with _registry_lock:
+            if include_cdc not in _registry:
+                _load_registry()
+            store = _registry[include_cdc]
+    return store
+
+
+def digest(include_cdc=False):
+    """ TableStore.digest of the shared tables, e.g. to version caches
+    and URLs of values calculated from them """
+    return get_tables(include_cdc).digest()
+
+
+def _load_registry():
+    all_tables = load_tables(WHO_TABLES + CDC_TABLES)
+    _registry_stats['loads'] += 1
+    # the WHO set shares its Table objects with the WHO+CDC set
+    _registry[False] = TableStore((table_name_for(t),
+                                   all_tables[table_name_for(t)])
+                                  for t in WHO_TABLES)
+    _registry[True] = all_tables
+
+
+def preload(include_cdc=True):
+    """ Load the shared tables ahead of time, e.g., before forking worker
+    processes or accepting requests. Returns stats(). """
+    get_tables(include_cdc)
+    return stats()
+
+
+def stats():
+    """ Number of times tables have been loaded from disk, the table sets
+    currently held, and the bytes of table data they hold. """
+    all_tables = _registry.get(True)
+    return {'loads': _registry_stats['loads'],
+            'table_sets': sorted('WHO+CDC' if k else 'WHO' for k in _registry),
+            'tables': len(all_tables) if all_tables is not None else 0,
+            'nbytes': all_tables.nbytes if all_tables is not None else 0}
+
+
+if __name__ == '__main__':
+    print('wrote %s' % compile_tables())
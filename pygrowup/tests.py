@@ -1,106 +1,35 @@
-import logging
+import math
 import os
+import sys
 import csv
-import codecs
+import datetime
+import shutil
+import tempfile
+from array import array
 from decimal import Decimal as D
 
-import nose
+import numpy
 
+from . import batch
+from . import conformance
+from . import exceptions
+from . import helpers
+from . import parity
 from . import pygrowup
+from . import tablestore
+from . import vectorized
+import six
 from six.moves import zip
 
 
-class WHOResult(object):
-    def __init__(self, indicator, values):
-        self.indicator = indicator
-        columns = 'id,region,GENDER,agemons,WEIGHT,_HEIGHT,measure,oedema,HEAD,MUAC,TRI,SUB,SW,agedays,CLENHEI,CBMI,ZWEI,ZLEN,ZWFL,ZBMI,FWEI,FLEN,FWFL,FBMI'
-        data = list(zip(columns.split(','), values))
-        for k, v in data:
-            setattr(self, k.lower(), v)
-        self.age = self.agemons
-        if int(self.gender) == 1:
-            self.gender = "M"
-        elif int(self.gender) == 2:
-            self.gender = "F"
-        else:
-            self.gender = None
-
-    def __repr__(self):
-        rep = self.indicator + " " + str(self.id) + " " + self.agemons
-        if all([self.gender, self.height]):
-            rep = rep + " (" + ", ".join([self.gender, self.height]) + ")"
-        return rep
-
-    @property
-    def result(self):
-        if self.indicator == "lhfa":
-            return self.zlen
-        if self.indicator in ["wfl", "wfh"]:
-            return self.zwfl
-        if self.indicator == "wfa":
-            return self.zwei
-        if self.indicator == "bmifa":
-            return self.zbmi
-
-    @property
-    def measurement(self):
-        if self.indicator == "lhfa":
-            return self._height
-        if self.indicator in ["wfl", "wfh"]:
-            return self.weight
-        if self.indicator == "wfa":
-            return self.weight
-        if self.indicator == "bmifa":
-            return self.cbmi
-
-    @property
-    def height(self):
-        if self.indicator in ["lhfa", "wfl", "wfh", "wfa"]:
-            return self._height
-        return None
-
-
-def compare_result(who):
-    our_result = None
-    logging.debug(who.indicator.upper() + " (" + str(who.measurement) + ") " + who.gender + " " + who.age + " " + str(who.height))
-    calc = pygrowup.Calculator(include_cdc=True, log_level='DEBUG')
-    if who.measurement:
-        our_result = calc.zscore_for_measurement(who.indicator, who.measurement,
-                                                 who.age, who.gender, who.height)
-        logging.info("THEM: " + str(who.result))
-        if who.result not in ['', ' ', None]:
-            if our_result is not None:
-                logging.info("US  : " + str(our_result))
-                diff = calc.context.subtract(D(who.result), D(our_result))
-                logging.info("DIFF: " + str(abs(diff)))
-                assert abs(diff) <= D('1')
-
-
-def test_generator():
+def test_conformance():
     # software uses error-prone floating-point calculations
-    module_dir = os.path.split(os.path.abspath(__file__))[0]
-    test_file = os.path.join(module_dir, 'testdata', 'survey_z_rc.csv')
-    csvee = codecs.open(test_file, "rU", encoding='utf-8', errors='ignore')
-
-    reader = csv.reader(csvee, dialect="excel")
-    # skip column labels
-    next(reader)
-    for row in reader:
-        for indicator in ["lhfa", "wfl", "wfh"]:
-            who = WHOResult(indicator, row)
-            # ignore these two cases
-            if who.id in ["287", "381"]:
-                continue
-            # also ignore other cases that are missing
-            # height or length data required for these calculations
-            if who.height not in ['', ' ', None]:
-                yield compare_result, who
-        for indicator in ["wfa", "bmifa"]:
-            who = WHOResult(indicator, row)
-            # ignore these two cases
-            if who.id in ["287", "381"]:
-                continue
-            yield compare_result, who
+    report = conformance.conformance()
+    for indicator, result in report.items():
+        assert result['rows'] > 0
+        assert result['unscored'] == 0
+        for file_name, row_id, ours, theirs in result['outliers']:
+            assert (indicator, row_id) in conformance.KNOWN_OUTLIERS
 
 
 def test_bmifa_bug():
@@ -120,5 +49,517 @@ def test_bmifa_bug():
                                                              3.1, 'F', 50)
     assert should_use_bmifa_girls_0_2 == D('7.41')
 
+
+def test_zscores_batch_matches_scalar():
+    columns = parity.MEASUREMENT_COLUMNS
+    for file_name in parity.SURVEY_FILES:
+        rows = parity.read_survey(file_name)
+        sexes = [r['GENDER'] for r in rows]
+        ages = [r['agemons'] for r in rows]
+        heights = [r['HEIGHT'] for r in rows]
+        for adjust in [False, True]:
+            calc = pygrowup.Calculator(include_cdc=True,
+                                       adjust_weight_scores=adjust)
+            for indicator, column in columns.items():
+                measurements = [r[column] for r in rows]
+                batch = calc.zscores_batch(indicator, measurements, ages,
+                                           sexes, heights)
+                for i, row in enumerate(rows):
+                    try:
+                        scalar = calc.zscore_for_measurement(
+                            indicator, measurements[i], ages[i], sexes[i],
+                            heights[i])
+                    except (AssertionError, RuntimeError):
+                        scalar = None
+                    if scalar is None:
+                        assert math.isnan(batch[i])
+                    else:
+                        assert D(str(batch[i])) == scalar
+
+
+def test_zscores_batch_scalars():
+    calc = pygrowup.Calculator()
+    zscores = calc.zscores_batch('wfa', 10, 12, 'M')
+    assert zscores.shape == (1,)
+    assert D(str(zscores[0])) == calc.wfa(10, 12, 'M')
+    # scalars broadcast against columns
+    zscores = calc.zscores_batch('wfl', [9, 10], 12, 'M', 75)
+    assert zscores.shape == (2,)
+    assert D(str(zscores[1])) == calc.wfl(10, 12, 'M', 75)
+
+
+def test_compiled_tables_match_json():
+    # the compiled tables must be rebuilt (python -m pygrowup.tablestore)
+    # whenever the JSON tables change
+    compiled = tablestore.load_compiled()
+    for table_file in tablestore.WHO_TABLES + tablestore.CDC_TABLES:
+        table = tablestore.load_json_table(
+            os.path.join(tablestore.table_dir, table_file))
+        other = compiled[table.name]
+        assert (table.field_name, table.first_key, table.step, table.size) ==\
+            (other.field_name, other.first_key, other.step, other.size)
+        for name, column in table.columns.items():
+            assert list(column) == list(other.columns[name])
+
+
+def test_table_digest():
+    json_tables = tablestore.load_tables(tablestore.WHO_TABLES, compiled=None)
+    compiled = tablestore.load_tables(tablestore.WHO_TABLES)
+    assert json_tables.digest() == compiled.digest() == tablestore.digest()
+    assert tablestore.digest(include_cdc=True) != tablestore.digest()
+
+    tables = dict(json_tables.items())
+    table = tables['wfa_boys_0_5']
+    columns = dict(table.columns, M=array('d', table.M))
+    columns['M'][0] += 0.0001
+    tables['wfa_boys_0_5'] = tablestore.Table(
+        table.name, table.field_name, table.first_key, table.step, columns)
+    assert tablestore.TableStore(tables).digest() != json_tables.digest()
+
+
+def test_table_store_rows_by_key():
+    calc = pygrowup.Calculator()
+    wfl = calc.tables['wfl_boys_0_2']
+    assert wfl.index(45) == 0
+    assert wfl.index(60.5) == 31
+    assert wfl.index(60.25) is None
+    assert wfl.index(110.5) is None
+    assert wfl.get('60.5') == wfl.row(31)
+    # standing height row for month 24 replaces the recumbent length row
+    lhfa = calc.tables['lhfa_boys_0_5']
+    assert lhfa.M[lhfa.index(24)] == 87.1161
+    assert 'wfa_boys_2_20' not in calc.tables
+
+
+def test_tables_shared_between_calculators():
+    loads = tablestore.stats()['loads']
+    who = pygrowup.Calculator()
+    cdc = pygrowup.Calculator(include_cdc=True)
+    assert pygrowup.Calculator().tables is who.tables
+    assert who.tables['wfa_boys_0_5'] is cdc.tables['wfa_boys_0_5']
+    assert tablestore.preload()['loads'] == max(loads, 1)
+    assert tablestore.stats()['nbytes'] > 0
+
+
+def test_float_precision_parity():
+    for adjust in [False, True]:
+        report = parity.parity_report(adjust_weight_scores=adjust)
+        for indicator, result in report.items():
+            assert result['rows'] > 0
+            assert result['unmatched'] == 0
+            assert result['max_abs_diff'] <= 0.01
+
+
+def test_resolve_table_boundaries():
+    def table_for(indicator, age, height=None, american=True):
+        return pygrowup.Observation(indicator, 1, age, 'F', height, american,
+                                    'pygrowup').resolve_table()
+    assert table_for('bmifa', 2.9) == 'bmifa_girls_0_13'
+    assert table_for('bmifa', 3) == 'bmifa_girls_0_2'
+    assert table_for('bmifa', 60) == 'bmifa_girls_2_5'
+    assert table_for('bmifa', 61) == 'bmifa_girls_2_20'
+    assert table_for('wfa', 24, american=False) == 'wfa_girls_0_5'
+    assert table_for('wfa', 24) == 'wfa_girls_2_20'
+    assert table_for('wfl', 12, 86) == 'wfl_girls_0_2'
+    assert table_for('wfl', 12, 86.5) == 'wfh_girls_2_5'
+    assert table_for('wfh', 30, 64.5) == 'wfl_girls_0_2'
+    assert table_for('wfh', 30, 65) == 'wfh_girls_2_5'
+    for indicator, age in [('hcfa', 24), ('bmifa', 241)]:
+        try:
+            table_for(indicator, age)
+        except exceptions.InvalidAge:
+            pass
+        else:
+            raise AssertionError('%s at %s months' % (indicator, age))
+
+
+def test_cutoffs_match_published_sds():
+    # published SD columns of the WHO tables are rounded to 0.1
+    columns = {-3: 'SD3neg', -2: 'SD2neg', 2: 'SD2', 3: 'SD3'}
+    for name, table in tablestore.get_tables().items():
+        if name.split('_')[0] not in ['wfa', 'wfl', 'wfh']:
+            continue
+        cutoffs = table.cutoffs()
+        assert table.cutoffs() is cutoffs
+        for sd, column in columns.items():
+            for calculated, published in zip(cutoffs[sd],
+                                             table.columns[column]):
+                assert abs(calculated - published) <= 0.05
+
+
+def test_reference_curves():
+    table = tablestore.get_tables()['wfa_girls_0_5']
+    keys = table.keys()
+    assert keys[0] == 0 and keys[-1] == 60 and len(keys) == len(table)
+    curves = table.curves()
+    assert sorted(curves) == list(tablestore.SD_CURVES)
+    assert list(curves[0]) == list(table.M)
+    assert list(curves[-3]) == list(table.cutoffs()[-3])
+    assert list(curves[2]) == list(table.cutoffs()[2])
+
+
+def test_all_indicators():
+    calc = pygrowup.Calculator(include_cdc=True)
+    rows = parity.read_survey('survey_z_rc.csv')
+    batch = calc.all_indicators_batch(
+        [r['WEIGHT'] for r in rows], [r['HEIGHT'] for r in rows],
+        [r['agemons'] for r in rows], [r['GENDER'] for r in rows],
+        [r['HEAD'] for r in rows])
+    for i, row in enumerate(rows):
+        results = calc.all_indicators(row['WEIGHT'], row['HEIGHT'],
+                                      row['agemons'], row['GENDER'],
+                                      row['HEAD'])
+        if float(row['agemons']) < 24:
+            assert results['wfh'] is None
+        else:
+            assert results['wfl'] is None
+        for indicator in ['wfa', 'lhfa', 'hcfa']:
+            assert results[indicator] == parity._zscore(calc, indicator, row)
+        for indicator, zscore in results.items():
+            if zscore is None:
+                assert math.isnan(batch[indicator][i])
+            else:
+                assert D(str(batch[indicator][i])) == zscore
+
+    # no height: only the indicators that do not need one
+    for precision in ['decimal', 'float']:
+        calc = pygrowup.Calculator(precision=precision)
+        for height in ['', None]:
+            for age in [12, 30]:
+                results = calc.all_indicators(10, height, age, 'M')
+                assert results['wfa'] is not None
+                for indicator in ['lhfa', 'wfl', 'wfh', 'bmifa', 'hcfa']:
+                    assert results[indicator] is None
+
+
+def test_batch_survey():
+    with parity.open_survey('survey_z_rc.csv') as f:
+        who = list(csv.DictReader(f))
+    with parity.open_survey('survey_z_rc.csv') as f:
+        scored = six.StringIO()
+        stats = batch.process(f, scored, chunk_size=64)
+    assert stats['rows'] == len(who)
+    scored.seek(0)
+    ours = list(csv.DictReader(scored))
+    for theirs, row in zip(who, ours):
+        assert row['id'] == theirs['id']
+        if theirs['_CLENHEI']:
+            assert abs(float(row['_CLENHEI']) -
+                       float(theirs['_CLENHEI'])) < 1e-5
+        for column in batch.ZSCORE_COLUMNS + batch.FLAG_COLUMNS:
+            # lengths just under 4 months, scored against the monthly
+            # table here and a daily one by WHO
+            if column == '_ZLEN' and row['id'] in ['136', '210', '397']:
+                continue
+            if row[column] and theirs[column]:
+                assert abs(float(row[column]) - float(theirs[column])) <= 1
+
+
+def test_batch_jobs_keep_order():
+    outputs = []
+    for jobs in [1, 3]:
+        with parity.open_survey('survey_z_st.csv') as f:
+            scored = six.StringIO()
+            batch.process(f, scored, chunk_size=50, jobs=jobs)
+        outputs.append(scored.getvalue())
+    assert outputs[0] == outputs[1]
+
+
+def test_batch_format_column():
+    values = numpy.array([-0.004, -0.0, -0.006, 1.234, numpy.nan])
+    assert batch.format_column('_ZWEI', values) == [
+        '0.00', '0.00', '-0.01', '1.23', '']
+    assert batch.format_column('_FWEI', numpy.array([0, 1, numpy.nan])) == [
+        '0', '1', '']
+    assert list(vectorized.as_code_array([' h', 'l', 'H', 'y '])) == [
+        'H', 'L', 'H', 'Y']
+
+
+def test_batch_short_rows_and_blank_lines():
+    survey = ('id,GENDER,agemons,WEIGHT,HEIGHT,measure\n'
+              '\n'
+              '1,1,12,9.5,75\n'
+              '2,2,30,12.1,90,h\n'
+              '   \n'
+              '3,1\n'
+              '\n')
+    scored = six.StringIO()
+    stats = batch.process(six.StringIO(survey), scored)
+    assert stats['rows'] == 3
+    rows = list(csv.DictReader(six.StringIO(scored.getvalue())))
+    assert [row['id'] for row in rows] == ['1', '2', '3']
+    assert rows[0]['measure'] == '' and rows[0]['_ZWEI'] != ''
+    assert rows[2]['WEIGHT'] == '' and rows[2]['_ZWEI'] == ''
+
+    # a chunk of nothing but blank lines
+    scored = six.StringIO()
+    stats = batch.process(six.StringIO('GENDER,agemons,WEIGHT,HEIGHT\n\n\n'),
+                          scored)
+    assert stats['rows'] == 0
+    assert scored.getvalue() == ('GENDER,agemons,WEIGHT,HEIGHT,' +
+                                 ','.join(batch.OUTPUT_COLUMNS) + '\n')
+    text, count, flags, unmapped = batch.score_records(
+        pygrowup.Calculator(), ['GENDER', 'agemons', 'WEIGHT', 'HEIGHT'],
+        ['\n', '1,12\n'])
+    assert count == 1 and text.startswith('1,12,,,')
+
+
+def test_batch_unmapped_sexes():
+    survey = ('GENDER,agemons,WEIGHT,HEIGHT\n'
+              '1,12,9.5,75\n'
+              'x,12,9.5,75\n'
+              ',30,12.1,90\n'
+              'x,30,12.1,90\n')
+    scored = six.StringIO()
+    stats = batch.process(six.StringIO(survey), scored, chunk_size=2)
+    assert stats['unmapped_sexes'] == {'x': 2, '': 1}
+    rows = list(csv.DictReader(six.StringIO(scored.getvalue())))
+    assert [row['_ZWEI'] == '' for row in rows] == [False, True, True, True]
+
+    stderr = sys.stderr
+    sys.stderr = six.StringIO()
+    try:
+        report = batch._report(stats)
+        assert "GENDER not recognized: 'x' 2, '' 1" in sys.stderr.getvalue()
+    finally:
+        sys.stderr = stderr
+    assert report is stats
+
+
+def test_batch_parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return
+    with parity.open_survey('survey_z_rc.csv') as f:
+        rows = list(csv.DictReader(f))
+        f.seek(0)
+        scored = six.StringIO()
+        csv_stats = batch.process(f, scored)
+    scored.seek(0)
+    expected = list(csv.DictReader(scored))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        survey = os.path.join(tmp_dir, 'survey.parquet')
+        output = os.path.join(tmp_dir, 'scored.parquet')
+        # string columns, as from a CSV import, in several row groups
+        pyarrow.parquet.write_table(
+            pyarrow.table(dict((k, [r[k] for r in rows]) for k in rows[0])),
+            survey, row_group_size=100)
+        stats = batch.process_columnar(survey, output)
+        table = pyarrow.parquet.read_table(output)
+    finally:
+        shutil.rmtree(tmp_dir)
+    assert stats['rows'] == table.num_rows == len(rows)
+    assert stats['unmapped_sexes'] == csv_stats['unmapped_sexes']
+    for column in batch.ZSCORE_COLUMNS + batch.FLAG_COLUMNS:
+        values = table.column(column).to_pylist()
+        for row, value in zip(expected, values):
+            if value is None:
+                assert row[column] == ''
+            else:
+                assert float(row[column]) == value
+
+
+def test_dataframe_accessor():
+    try:
+        import pandas
+        from . import accessor
+    except ImportError:
+        return
+    rows = parity.read_survey('survey_z_st.csv')
+    df = pandas.DataFrame(rows, index=range(1000, 1000 + len(rows)))
+    calc = pygrowup.Calculator(include_cdc=True)
+    zscores = df.growup.zscores(['wfa', 'lhfa', 'wfh'], calculator=calc)
+    assert list(zscores.columns) == ['wfa', 'lhfa', 'wfh']
+    assert (zscores.index == df.index).all()
+    expected = calc.all_indicators_batch(
+        df.WEIGHT, df.HEIGHT, df.agemons, df.GENDER, df.HEAD)
+    for indicator in zscores.columns:
+        assert zscores[indicator].equals(
+            pandas.Series(expected[indicator], index=df.index,
+                          name=indicator))
+
+    survey = df.growup.survey()
+    assert list(survey.columns) == batch.OUTPUT_COLUMNS
+    assert str(survey['_FWEI'].dtype) == 'Int8'
+    assert survey['_ZLEN'].count() == sum(1 for r in rows if r['HEIGHT'])
+
+
+def test_benchmarks():
+    from . import benchmarks
+    rows = benchmarks.survey_rows()
+    latency = benchmarks.bench_latency(rows, 'float', calls=10)
+    assert sorted(latency) == sorted(benchmarks.LATENCY_INDICATORS)
+    assert all(r['calls'] == 10 for r in latency.values())
+    result = benchmarks.bench_batch(rows, size=5000, repeat=1)
+    assert result['rows'] == 5000 and result['rows_per_second'] > 0
+
+
+def test_bulk_dates():
+    dates = ['150320', '15032020', '5320', '2020-03-15', '12345', 'abc',
+             '', None, '310219', datetime.date(2020, 3, 15)]
+    parsed = helpers.get_good_dates(dates)
+    for date, result in zip(dates, parsed):
+        if date in ['2020-03-15', dates[-1]]:
+            assert str(result) == '2020-03-15'
+        elif helpers.get_good_date(date or '')[1] is None:
+            assert str(result) == 'NaT'
+        else:
+            assert str(result) == helpers.get_good_date(date)[0]
+    assert str(parsed[8]) == '2019-02-28'
+
+    days, months = helpers.dates_to_ages(
+        ['2020-01-15', '2020-01-15', '', '2022-01-16'],
+        ['2022-01-15', '2020-03-01', '2022-01-15', '2022-01-15'])
+    assert days[0] == 731 and days[1] == 46
+    assert math.isnan(days[2]) and math.isnan(days[3])
+    assert months[0] == 731 / helpers.DAYS_PER_MONTH
+
+    days, months = helpers.dates_to_ages(['2020-01-15'], '2022-01-15')
+    assert days[0] == 731
+
+
+def test_bulk_sexes():
+    genders = ['1', '2', 1, 2.0, 'L', 'p', 'M', 'f', ' Male ', 'FEMALE',
+               'Laki-laki', 'perempuan', 'monkey', '', None, float('nan'),
+               'monkey']
+    sexes, unmapped = helpers.get_good_sexes(genders)
+    assert ''.join(sexes) == 'MFMFMFMFMFMF'
+    assert unmapped['monkey'] == 2
+    assert unmapped[''] == 1
+    assert unmapped[None] == 2
+    assert sum(unmapped.values()) == 5
+
+
+def test_flags():
+    flags = vectorized.flag_zscores('wfa', numpy.array(
+        [-6.01, -6, 0, 5, 5.01, numpy.nan]))
+    assert flags[:5].tolist() == [1, 0, 0, 0, 1]
+    assert math.isnan(flags[5])
+    assert vectorized.count_flags(flags) == {'scored': 5, 'flagged': 2}
+
+    survey = six.StringIO('GENDER,agemons,WEIGHT,HEIGHT\n'
+                          '1,12,30,60\n'
+                          '2,22.45,10.4,84.8\n'
+                          '1,30,2,90\n'
+                          '2,10,,80\n')
+    scored = six.StringIO()
+    stats = batch.process(survey, scored, chunk_size=3)
+    scored.seek(0)
+    rows = list(csv.DictReader(scored))
+    assert [r['_FWEI'] for r in rows] == ['1', '0', '1', '']
+    assert [r['_FLEN'] for r in rows] == ['1', '0', '0', '0']
+    assert stats['flags']['_FWEI'] == {'scored': 3, 'flagged': 2}
+    assert stats['flags']['_FLEN'] == {'scored': 4, 'flagged': 1}
+
+    calc = pygrowup.Calculator()
+    results = calc.all_indicators_batch([30, 10.4], [60, 84.8], [12, 22.45],
+                                        ['M', 'F'], flags=True)
+    assert results['wfa_flag'].tolist() == [1, 0]
+    assert results['lhfa_flag'].tolist() == [1, 0]
+
+
+def test_prevalence():
+    from . import aggregate
+    prevalence = aggregate.Prevalence(by=['region'], indicators=['_ZLEN'])
+    prevalence.add({'region': ['a', 'a', 'b'], '_ZLEN': [-2.5, -1, -3.5]})
+    prevalence.add({'region': ['a', 'b', 'b'], '_ZLEN': [0.5, 1, numpy.nan],
+                    '_FLEN': [0, 1, 0]})
+    results = prevalence.results()
+    a = results[('a',)]['_ZLEN']
+    assert a['n'] == 3 and a['below_2'] == 1 and a['below_3'] == 0
+    assert abs(a['mean'] - -1.0) < 1e-12
+    assert abs(a['sd'] - numpy.std([-2.5, -1, 0.5], ddof=1)) < 1e-12
+    # the flagged 1 and the missing z-score are left out
+    assert results[('b',)]['_ZLEN']['n'] == 1
+    assert results[('b',)]['_ZLEN']['prevalence_below_3'] == 100.0
+
+    # short rows are padded, blank lines skipped
+    columns = aggregate.scored_columns(
+        pygrowup.Calculator(), ['GENDER', 'agemons', 'WEIGHT', 'HEIGHT'],
+        ['1,12,9.5,75\n', '\n', '2,30\n'])
+    assert columns['WEIGHT'] == ['9.5', '']
+    assert len(columns['_ZWEI']) == 2 and numpy.isnan(columns['_ZWEI'][1])
+
+    # chunked, and in worker processes, the same as all at once
+    by = ['region', 'age_band', 'sex']
+    with parity.open_survey('survey_z_rc.csv') as f:
+        whole = aggregate.survey_prevalence(f, by).results()
+    with parity.open_survey('survey_z_rc.csv') as f:
+        chunked = aggregate.survey_prevalence(f, by, chunk_size=40,
+                                              jobs=2).results()
+    assert sorted(whole) == sorted(chunked)
+    for key in whole:
+        for indicator, r in whole[key].items():
+            other = chunked[key][indicator]
+            assert r['n'] == other['n']
+            assert r['below_2'] == other['below_2']
+            assert abs(r['mean'] - other['mean']) < 1e-9
+
+
+def test_survey_estimates():
+    from . import aggregate
+    columns = {'region': ['a', 'a', 'a', 'b', 'b', 'b'],
+               'cluster': [1, 1, 2, 3, 4, 4],
+               'SW': [1, 3, 2, 1, 1, numpy.nan],
+               '_ZLEN': [-2.5, -1, 0, -3.5, 1, -2.5]}
+    results = aggregate.survey_estimates(columns, ['region'], ['_ZLEN'],
+                                         replicates=0)
+    a = results[('a',)]['_ZLEN']
+    assert a['n'] == 3
+    assert abs(a['mean'] - (-2.5 - 3) / 6) < 1e-12
+    assert abs(a['prevalence_below_2'] - 100 / 6.) < 1e-9
+    # the row without a weight is left out
+    assert results[('b',)]['_ZLEN']['n'] == 2
+    assert results[('b',)]['_ZLEN']['prevalence_below_3'] == 50
+
+    # intervals depend on the seed, not on the number of jobs
+    once = aggregate.survey_estimates(columns, ['region'], ['_ZLEN'],
+                                      cluster='cluster', replicates=120,
+                                      seed=1)
+    again = aggregate.survey_estimates(columns, ['region'], ['_ZLEN'],
+                                       cluster='cluster', replicates=120,
+                                       seed=1, jobs=2)
+    assert once == again
+    low, high = once[('a',)]['_ZLEN']['mean_ci']
+    assert low <= a['mean'] <= high
+
+    # read and scored a chunk at a time, the same as all at once
+    with parity.open_survey('survey_z_rc.csv') as f:
+        records = batch.read_records(f)
+        header = next(csv.reader([next(records)]))
+        columns = aggregate.scored_columns(pygrowup.Calculator(), header,
+                                           records)
+    whole = aggregate.survey_estimates(columns, ['sex'], strata='region',
+                                       replicates=40, seed=1)
+    with parity.open_survey('survey_z_rc.csv') as f:
+        design = aggregate.survey_design(f, ['sex'], strata='region',
+                                         chunk_size=40, jobs=2)
+    chunked = design.results(replicates=40, seed=1)
+    assert sorted(whole) == sorted(chunked)
+    for key in whole:
+        for indicator, r in whole[key].items():
+            other = chunked[key][indicator]
+            assert r['n'] == other['n']
+            for name in ['mean', 'prevalence_below_2']:
+                assert abs(r[name] - other[name]) < 1e-9
+                assert numpy.allclose(r[name + '_ci'], other[name + '_ci'])
+
+    # adding to a merged design leaves the merged partial as it was
+    chunk = {'region': ['a', 'b'], 'SW': [1, 1], '_ZLEN': [-2.5, 0]}
+    partial = aggregate.SurveyDesign(['region'], ['_ZLEN']).add(chunk)
+    merged = aggregate.SurveyDesign(['region'], ['_ZLEN']).merge(partial)
+    merged.add(chunk)
+    assert partial.n[('a',)].tolist() == [1]
+    assert merged.n[('a',)].tolist() == [2]
+
+
 if __name__ == '__main__':
-    nose.main()
+    # python -m pygrowup.tests, or run with pytest
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('ok %s' % name)
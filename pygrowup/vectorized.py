@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4
+""" Vectorized (NumPy) implementation of the LMS z-score calculation.
+
+    The rules here mirror Calculator.zscore_for_measurement and
+    Observation.resolve/lookup row for row, but they are applied
+    to whole columns at once. Rows that the scalar path would reject (by
+    raising or asserting) come back as NaN instead, so a single bad row
+    does not abort a survey of hundreds of thousands of children.
+"""
+import numpy as np
+
+from . import dispatch
+
+
+INDICATORS = ["lhfa", "wfl", "wfh", "wfa", "bmifa", "hcfa"]
+
+# same constant used by Observation.age_in_weeks
+DAYS_PER_MONTH = 30.4374
+
+# z-scores outside these limits are flagged as implausible
+# (WHO Child Growth Standards, as used by WHO Anthro)
+FLAG_LIMITS = {'wfa': (-6, 5), 'lhfa': (-6, 6), 'wfl': (-5, 5),
+               'wfh': (-5, 5), 'bmifa': (-5, 5), 'hcfa': (-5, 5)}
+
+
+def as_float_array(values, size=None):
+    """ Cast a sequence (or scalar) to a float64 array, turning blanks
+    and values that cannot be parsed into NaN. """
+    if values is None:
+        return np.full(size or 0, np.nan)
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    try:
+        # columns of strings read from a file, with blanks for missing
+        strings = np.asarray(values, dtype=str)
+        return np.where(np.char.str_len(strings) == 0, 'nan',
+                        strings).astype(np.float64)
+    except (TypeError, ValueError):
+        pass
+
+    def to_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+    return np.array([to_float(v) for v in np.atleast_1d(values)],
+                    dtype=np.float64)
+
+
+def as_code_array(values):
+    """ Stripped, upper-cased codes (e.g. sex, measure or oedema) as a
+    unicode array """
+    codes = np.asarray(values)
+    # columns have only a handful of distinct values, so normalize each
+    # of those once (a dict is much faster than sorting with np.unique)
+    uniques = {}
+    indices = [uniques.setdefault(value, len(uniques))
+               for value in codes.ravel().tolist()]
+    normalized = np.char.upper(np.char.strip(
+        np.array([str(value) for value in uniques], dtype=str)))
+    return normalized[np.array(indices, dtype=np.intp)].reshape(codes.shape)
+
+
+def as_sex_array(values):
+    """ Upper-cased sex codes as a unicode array ('M', 'F' or other). """
+    return as_code_array(values)
+
+
+def round_half_cm(height):
+    """ Vectorized Observation.rounded_height, as floats """
+    correction = np.where(height >= 0, 0.5, -0.5)
+    return np.trunc(height / 0.5 + correction) * 0.5
+
+
+def lms_arrays(table):
+    """ L, M, and S columns of a tablestore.Table as float64 arrays
+    (views of the table's own buffers, not copies) """
+    return [np.frombuffer(table.columns[name], dtype=np.float64)
+            for name in ('L', 'M', 'S')]
+
+
+def age_buckets(ages, weeks):
+    """ Vectorized dispatch.age_bucket """
+    return np.select([(ages <= 3) & (weeks <= 13), ages < 24, ages <= 60,
+                      ages <= 240],
+                     [dispatch.AGE_WEEKS, dispatch.AGE_UNDER_24,
+                      dispatch.AGE_24_TO_60, dispatch.AGE_60_TO_240],
+                     dispatch.AGE_OVER_240)
+
+
+def height_bands(heights):
+    """ Vectorized dispatch.height_band """
+    return np.select([heights < 65, heights <= 86],
+                     [dispatch.HEIGHT_UNDER_65, dispatch.HEIGHT_65_TO_86],
+                     dispatch.HEIGHT_OVER_86)
+
+
+def zscores_batch(calculator, indicator, measurements, ages, sexes,
+                  heights=None):
+    """ Calculate z-scores for whole columns of observations.
+
+    Accepts sequences or NumPy arrays (scalars are broadcast, and all
+    scalars give an array of one z-score) and returns a float64 array of z-scores quantized to hundredths, with NaN for any
+    row that zscore_for_measurement would refuse to score. """
+    assert indicator is not None
+    indicator = indicator.lower()
+    assert indicator in INDICATORS
+    y, ages, sexes, heights = prepare_columns(measurements, ages, sexes,
+                                              heights)
+    return _zscores(calculator, indicator, y, ages, sexes, heights)
+
+
+def all_indicators_batch(calculator, weights, heights, ages, sexes,
+                         head_circumferences=None, indicators=None,
+                         flags=False):
+    """ Calculator.all_indicators for whole columns of children.
+
+    Columns are parsed once and shared by all of the indicators. Returns
+    a dict of float64 arrays keyed by indicator (all of them, or those
+    listed in indicators), with NaN where an indicator does not apply
+    (wfl from 24 months, wfh under 24 months) or cannot be calculated.
+    With flags, the dict also has the flag_zscores of each indicator,
+    keyed by indicator + '_flag' (e.g., wfa_flag). """
+    if indicators is None:
+        indicators = INDICATORS
+    assert all(indicator in INDICATORS for indicator in indicators)
+    weights, ages, sexes, heights, head_circumferences = prepare_columns(
+        weights, ages, sexes, heights, head_circumferences)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bmi = weights / (heights / 100) ** 2
+    measurements = {'wfa': weights, 'lhfa': heights,
+                    'wfl': np.where(ages < 24, weights, np.nan),
+                    'wfh': np.where(ages >= 24, weights, np.nan),
+                    'bmifa': bmi, 'hcfa': head_circumferences}
+    results = {}
+    for indicator in indicators:
+        results[indicator] = _zscores(calculator, indicator,
+                                      measurements[indicator], ages, sexes,
+                                      heights)
+        if flags:
+            results[indicator + '_flag'] = flag_zscores(indicator,
+                                                        results[indicator])
+    return results
+
+
+def flag_zscores(indicator, zscores):
+    """ 1 where a z-score is outside the FLAG_LIMITS of its indicator, 0
+    where it is inside, and NaN where there is no z-score """
+    low, high = FLAG_LIMITS[indicator]
+    with np.errstate(invalid='ignore'):
+        return np.where(np.isnan(zscores), np.nan,
+                        (zscores < low) | (zscores > high))
+
+
+def count_flags(flags):
+    """ Number of rows scored and of rows flagged, given flag_zscores """
+    return {'scored': int(np.count_nonzero(~np.isnan(flags))),
+            'flagged': int(np.count_nonzero(flags == 1))}
+
+
+def prepare_columns(measurements, ages, sexes, heights=None, *others):
+    """ Parse columns into float (and, for sexes, unicode) arrays of a
+    common length, at least 1, so that scalars are columns of one row.
+    Missing heights (or other columns) become NaN. """
+    columns = [as_float_array(measurements), as_float_array(ages),
+               as_sex_array(sexes)]
+    for column in (heights,) + others:
+        columns.append(as_float_array(np.nan if column is None else column))
+    return np.broadcast_arrays(*[np.atleast_1d(c) for c in columns])
+
+
+def _zscores(calculator, indicator, y, ages, sexes, heights):
+    y = np.array(y, dtype=np.float64)
+
+    # reject measurements 0 or less, unknown sexes, and missing ages
+    valid = (y > 0) & ((sexes == "M") | (sexes == "F"))
+
+    # indicator-specific methodology (see zscore_for_measurement)
+    if indicator == "wfl":
+        reclined = (y > 65.7) & (y < 120.7)
+        y[reclined] -= 0.7
+    if indicator == "wfh" and calculator.adjust_height_data:
+        y += 0.7
+
+    weeks = (ages * DAYS_PER_MONTH) / 7
+    valid &= ~np.isnan(ages)
+    if indicator in ["wfl", "wfh"]:
+        valid &= (heights >= 45) & (heights <= 120)
+        age_bucket = np.full(y.shape, dispatch.AGE_WEEKS)
+        height_band = height_bands(heights)
+    else:
+        age_bucket = age_buckets(ages, weeks)
+        height_band = np.full(y.shape, dispatch.HEIGHT_UNDER_65)
+
+    box_cox_power = np.full(y.shape, np.nan)
+    median_for_age = np.full(y.shape, np.nan)
+    coefficient_of_variance_for_age = np.full(y.shape, np.nan)
+    restricted = (calculator.adjust_weight_scores and
+                  indicator in ["wfl", "wfh", "wfa"])
+    if restricted:
+        # SD cutoffs keyed by SD (see tablestore.Table.cutoffs)
+        cutoffs = dict((sd, np.full(y.shape, np.nan))
+                       for sd in (-3, -2, 2, 3))
+
+    # one code per dispatch key, so each table is handled in one go
+    is_male = sexes == "M"
+    codes = (is_male * len(dispatch.AGE_BUCKETS) + age_bucket) *\
+        len(dispatch.HEIGHT_BANDS) + height_band
+    american = bool(calculator.include_cdc)
+    for code in np.unique(codes[valid]):
+        sex, rest = divmod(int(code), len(dispatch.AGE_BUCKETS) *
+                           len(dispatch.HEIGHT_BANDS))
+        age, height = divmod(rest, len(dispatch.HEIGHT_BANDS))
+        try:
+            table = dispatch.resolve(indicator, "M" if sex else "F", age,
+                                     height, american)
+        except RuntimeError:
+            # InvalidAge or DataNotFound in the scalar path
+            continue
+        rows = valid & (codes == code)
+        L, M, S = lms_arrays(table)
+        if table.field_name in ["Length", "Height"]:
+            keys = round_half_cm(heights[rows])
+        elif table.field_name == "Week":
+            keys = np.floor(weeks[rows])
+        else:
+            keys = np.floor(ages[rows])
+        index = np.rint((keys - table.first_key) / table.step)
+        found = (index >= 0) & (index < L.shape[0])
+        index = index[found].astype(np.intp)
+        targets = np.flatnonzero(rows)[found]
+        box_cox_power[targets] = L[index]
+        median_for_age[targets] = M[index]
+        coefficient_of_variance_for_age[targets] = S[index]
+        if restricted:
+            for sd, column in table.cutoffs().items():
+                cutoffs[sd][targets] = np.frombuffer(column)[index]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        zscores = ((np.power(y / median_for_age, box_cox_power) - 1) /
+                   (coefficient_of_variance_for_age * box_cox_power))
+
+        if restricted:
+            # restricted application of the LMS method
+            # (see comment in zscore_for_measurement)
+            zscores = np.select(
+                [zscores > 3, zscores < -3],
+                [3 + (y - cutoffs[3]) / (cutoffs[3] - cutoffs[2]),
+                 -3 + (y - cutoffs[-3]) / (cutoffs[-2] - cutoffs[-3])],
+                zscores)
+
+    return np.round(zscores, 2)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Test API perhitungan dengan Flask test client
+"""
+
+import io
+import os
+import csv
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# database di memori, bukan anthrogizi.db
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pygrowup
+from app import app, result_cache, ResultCache, LatencyStats
+from models import create_tables
+
+create_tables(app)
+
+
+def post(client, url, data):
+    response = client.post(url, json=data)
+    assert response.status_code == 200
+    return response
+
+
+def test_calculate_all_uses_pygrowup():
+    result_cache.clear()
+    client = app.test_client()
+    data = {'weight': 10.4, 'height': 84.8, 'age_months': 22.45,
+            'gender': 'P', 'head_circumference': 46}
+    response = post(client, '/api/calculate-all', data)
+    results = response.get_json()['results']
+
+    calc = pygrowup.Calculator()
+    assert results['waz'] == round(float(calc.wfa(10.4, 22.45, 'F')), 2)
+    assert results['haz'] == round(float(calc.lhfa(84.8, 22.45, 'F')), 2)
+    assert results['whz'] == round(float(calc.wfl(10.4, 22.45, 'F', 84.8)), 2)
+    assert results['hcz'] == round(float(calc.hcfa(46, 22.45, 'F')), 2)
+    assert results['waz_status'] == 'Gizi Baik'
+    assert response.headers['Server-Timing'].startswith('calc;dur=')
+
+    # hasil sama untuk input yang sama
+    again = post(client, '/api/calculate-all', data).get_json()['results']
+    assert again['waz'] == results['waz']
+
+
+def test_calculate_all_omits_indices_that_do_not_apply():
+    client = app.test_client()
+    results = post(client, '/api/calculate-all', {
+        'weight': 12.1, 'height': 85.2, 'age_months': 24,
+        'gender': 'L'}).get_json()['results']
+    assert 'whz' in results and 'baz' in results
+    assert 'hcz' not in results
+
+
+def test_calculate_all_rejects_invalid_gender():
+    client = app.test_client()
+    result = post(client, '/api/calculate-all', {
+        'weight': 10, 'height': 80, 'age_months': 12,
+        'gender': 'X'}).get_json()
+    assert result['success'] is False
+
+
+def test_metrics():
+    result_cache.clear()
+    client = app.test_client()
+    post(client, '/api/calculate-all', {
+        'weight': 10, 'height': 80, 'age_months': 12, 'gender': 'L'})
+    summary = client.get('/api/metrics').get_json()['latency']['calculate_all']
+    assert summary['calls'] >= 1
+    assert summary['p50_us'] <= summary['p99_us']
+
+    stats = LatencyStats(window=3)
+    for seconds in [0.5, 0.001, 0.002, 0.003]:
+        stats.record(seconds)
+    summary = stats.summary()
+    assert summary['calls'] == 3 and summary['total_calls'] == 4
+    assert summary['p50_us'] == 2000.0 and summary['p99_us'] == 2980.0
+
+
+def test_calculate_batch_streams_ndjson():
+    client = app.test_client()
+    response = post(client, '/api/calculate-batch', [
+        {'id': 'a', 'weight': 10.4, 'height': 84.8, 'age_months': 22.45,
+         'gender': 'P'},
+        {'id': 'b', 'weight': 'x', 'height': 80, 'age_months': 12,
+         'gender': 'L'},
+        {'weight': 12.1, 'height': 85.2, 'age_months': 24, 'gender': 'L'}])
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in
+             response.get_data(as_text=True).splitlines()]
+    assert [line['row'] for line in lines] == [1, 2, 3]
+    assert [line['success'] for line in lines] == [True, False, True]
+    assert lines[0]['id'] == 'a' and lines[1]['id'] == 'b'
+    assert 'error' in lines[1]
+
+    single = post(client, '/api/calculate-all', {
+        'weight': 10.4, 'height': 84.8, 'age_months': 22.45,
+        'gender': 'P'}).get_json()['results']
+    assert lines[0]['results']['waz'] == single['waz']
+
+
+def test_calculate_batch_csv():
+    client = app.test_client()
+    text = ('id,weight,height,age_months,gender,head_circumference\n'
+            '1,10,80,12,P,\n'
+            '2,12,90,30,L,48\n')
+    response = client.post('/api/calculate-batch', data=text,
+                           content_type='text/csv')
+    lines = [json.loads(line) for line in
+             response.get_data(as_text=True).splitlines()]
+    assert [line['id'] for line in lines] == ['1', '2']
+    assert 'hcz' not in lines[0]['results']
+    assert 'hcz' in lines[1]['results']
+
+    upload = client.post('/api/calculate-batch', data={
+        'file': (io.BytesIO(text.encode('utf-8')), 'posyandu.csv')})
+    assert upload.get_data(as_text=True) == response.get_data(as_text=True)
+
+
+def test_calculate_batch_rejects_bad_input():
+    client = app.test_client()
+    response = client.post('/api/calculate-batch', json={'weight': 10})
+    assert response.status_code == 400
+    too_large = 'x' * (app.config['MAX_CONTENT_LENGTH'] + 1)
+    response = client.post('/api/calculate-batch', data=too_large,
+                           content_type='text/csv')
+    assert response.status_code == 413
+
+
+class SharedCache:
+    """Pengganti redis untuk test: get/setex di dict"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, timeout, value):
+        self.values[key] = value
+
+
+def test_result_cache():
+    result_cache.clear()
+    client = app.test_client()
+    before = result_cache.stats()
+    data = {'weight': 9.87, 'height': 75.43, 'age_months': 11.5,
+            'gender': 'L'}
+    first = post(client, '/api/calculate-all', data)
+    # dibulatkan ke resolusi alat ukur: kunci cache yang sama
+    second = post(client, '/api/calculate-all', dict(data, height=75.4))
+    assert second.headers['Server-Timing'] == 'cache;desc=hit'
+    assert second.get_json() == first.get_json()
+    assert first.get_json()['results']['height'] == 75.4
+
+    for i in range(2):
+        post(client, '/api/easy-mode', {'age_months': 12, 'gender': 'P'})
+    after = result_cache.stats()
+    assert after['hits'] - before['hits'] == 2
+    assert after['misses'] - before['misses'] == 2
+
+    cache = ResultCache(max_entries=2, timeout=60)
+    assert pygrowup.tablestore.digest()[:16] in cache.key('x', 0)
+    for i in range(3):
+        cache.cached('x', i, lambda: i)
+    assert cache.get(cache.key('x', 0)) == (None, 'miss')
+    assert cache.get(cache.key('x', 2)) == (2, 'hit')
+
+    shared = SharedCache()
+    one = ResultCache(shared=shared)
+    other = ResultCache(shared=shared)
+    one.cached('x', 1, lambda: {'waz': 1.5})
+    assert other.cached('x', 1, lambda: None) == ({'waz': 1.5}, 'shared')
+    assert other.cached('x', 1, lambda: None) == ({'waz': 1.5}, 'hit')
+
+
+def test_reference_curves():
+    client = app.test_client()
+    results = post(client, '/api/calculate-all', {
+        'weight': 10, 'height': 80, 'age_months': 12,
+        'gender': 'P'}).get_json()['results']
+    # hanya titik anak, kurva diambil dari URL terpisah
+    chart = results['chart_data']['weight_chart']
+    assert chart['child_data'] == [{'x': 12.0, 'y': 10.0}]
+    assert 'who_reference' not in chart
+
+    # versi URL dari isi tabel rujukan
+    assert chart['curves_url'].split('/')[3] == \
+        pygrowup.tablestore.digest()[:16]
+    response = client.get(chart['curves_url'])
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    curves = response.get_json()
+    assert curves['keys'][0] == 0 and curves['keys'][-1] == 60
+    assert sorted(curves['curves'], key=int) == [
+        '-3', '-2', '-1', '0', '1', '2', '3']
+    calc = pygrowup.Calculator()
+    assert curves['curves']['0'][12] == round(calc.wfa_girls_0_5.M[12], 3)
+
+    again = client.get(chart['curves_url'], headers={
+        'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+    bmifa = client.get(chart['curves_url'].replace('/wfa/', '/bmifa/'))
+    assert bmifa.get_json()['keys'] == list(range(61))
+    assert client.get('/api/reference-curves/v0/wfa/P').status_code == 404
+
+
+def test_export_data():
+    client = app.test_client()
+    rows = [{'name': 'Ani', 'weight': 10.4, 'results': {'waz': -0.5}},
+            {'name': 'Budi', 'height': 80}]
+
+    response = post(client, '/api/export-data', {'format': 'csv',
+                                                 'data': rows})
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 3
+    assert lines[0].split(',') == ['name', 'results', 'weight', 'height']
+
+    response = post(client, '/api/export-data', {'format': 'excel',
+                                                 'data': rows})
+    import openpyxl
+    sheet = openpyxl.load_workbook(io.BytesIO(response.data)).active
+    assert list(sheet.values)[2] == ('Budi', None, None, 80)
+
+    response = post(client, '/api/export-data', {'format': 'pdf',
+                                                 'data': rows})
+    assert response.data.startswith(b'%PDF')
+
+    # teks seperti rumus tidak dijalankan oleh aplikasi spreadsheet
+    rows = [{'name': '=HYPERLINK("http://x","y")', '@note': '-1+2',
+             'url': 'http://example.com', 'waz': -0.5}]
+    response = post(client, '/api/export-data', {'format': 'csv',
+                                                 'data': rows})
+    assert list(csv.reader(io.StringIO(response.get_data(as_text=True)))) == [
+        ["'@note", 'name', 'url', 'waz'],
+        ["'-1+2", "'=HYPERLINK(\"http://x\",\"y\")", 'http://example.com',
+         '-0.5']]
+    response = post(client, '/api/export-data', {'format': 'excel',
+                                                 'data': rows})
+    sheet = openpyxl.load_workbook(io.BytesIO(response.data)).active
+    cell = sheet.cell(row=2, column=2)
+    assert cell.data_type == 's' and cell.value == rows[0]['name']
+    assert sheet.cell(row=2, column=3).hyperlink is None
+    assert sheet.cell(row=2, column=4).value == -0.5
+
+    response = client.post('/api/export-data', json={'format': 'doc',
+                                                     'data': rows})
+    assert response.status_code == 400
+    too_many = [{'name': 'x'}] * (app.config['EXPORT_MAX_RECORDS'] + 1)
+    response = client.post('/api/export-data', json={'format': 'csv',
+                                                     'data': too_many})
+    assert response.status_code == 400
+
+
+def test_init_db_command():
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0
+    assert 'Tabel database siap' in result.output
+
+
+def test_save_calculation():
+    client = app.test_client()
+    saved = post(client, '/api/save-calculation', {
+        'child_id': 'T-1', 'child_name': 'Ani', 'gender': 'P',
+        'weight': 10.4, 'height': 84.8, 'age_months': 22.45,
+        'birth_date': '2024-11-20', 'measurement_date': '2026-10-01'})
+    assert saved.get_json()['success'] is True
+
+    batch = post(client, '/api/save-calculation', [
+        {'child_id': 'T-1', 'weight': 10.9, 'measurement_date': '2026-11-01'},
+        {'child_id': 'T-2', 'weight': 9.1, 'measurement_date': '2026-11-01'}])
+    ids = batch.get_json()['ids']
+    assert len(ids) == 2 and ids[0] > saved.get_json()['id']
+
+    history = client.get('/api/measurements?child_id=T-1').get_json()
+    measurements = history['measurements']
+    assert [m['measurement_date'] for m in measurements] == [
+        '2026-10-01', '2026-11-01']
+    assert measurements[0]['child_name'] == 'Ani'
+    assert measurements[0]['data']['height'] == 84.8
+
+    page = client.get('/api/measurements?date_from=2026-11-01&limit=1')
+    page = page.get_json()
+    assert [m['id'] for m in page['measurements']] == ids[:1]
+    rest = client.get('/api/measurements?date_from=2026-11-01&after_id=%d'
+                      % page['next_after_id']).get_json()
+    assert [m['id'] for m in rest['measurements']] == ids[1:]
+
+    # limit di atas batas: halaman penuh tetap memberi cursor
+    max_records = app.config['EXPORT_MAX_RECORDS']
+    app.config['EXPORT_MAX_RECORDS'] = 1
+    try:
+        page = client.get('/api/measurements?date_from=2026-11-01&limit=5')
+    finally:
+        app.config['EXPORT_MAX_RECORDS'] = max_records
+    page = page.get_json()
+    assert [m['id'] for m in page['measurements']] == ids[:1]
+    assert page['next_after_id'] == ids[0]
+
+    # satu baris tidak valid: tidak ada yang disimpan
+    response = client.post('/api/save-calculation', json=[
+        {'child_id': 'T-3', 'weight': 9},
+        {'child_id': 'T-3', 'measurement_date': '01/11/2026'}])
+    assert response.status_code == 400
+    assert client.get('/api/measurements?child_id=T-3').get_json()[
+        'measurements'] == []